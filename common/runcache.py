@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import cPickle as pickle
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+
+class RunCache:
+    """
+    On-disk cache of the results of single simulation runs.
+
+    A run is identified by the settings that affect its outcome, its RNG
+    seed, and the source of the code that ran it (agent modules and the
+    simulator itself), so editing an agent invalidates its old results.
+    Modules are identified by file name, not module name, so sim.py run as
+    a script (__main__) and imported by another script (sim) share entries.
+    Entries are pickles named by the SHA-1 of all that.  When the cache
+    grows past max_bytes the least recently used entries are removed.
+    """
+    def __init__(self, path, max_bytes, modules):
+        """
+        path: directory to keep results in; created if needed
+        modules: names of the (already imported) modules whose source the
+        results depend on
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.code = RunCache.code_hash(modules)
+        self.size = sum(size for (mtime, size, f) in self._entries())
+
+    @staticmethod
+    def code_hash(modules):
+        sources = set()
+        for name in modules:
+            source = sys.modules[name].__file__
+            if source.endswith((".pyc", ".pyo")):
+                source = source[:-1]
+            sources.add((os.path.basename(source), source))
+        h = hashlib.sha1()
+        for (filename, source) in sorted(sources):
+            h.update(filename + "\0")
+            with open(source, "rb") as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def key(self, settings, seed):
+        """
+        settings: dict of the config values that affect a run's results.
+        Values must be JSON-serializable.
+        """
+        blob = json.dumps([settings, seed, self.code], sort_keys=True)
+        return hashlib.sha1(blob).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def _entries(self):
+        """[(mtime, size, filename)] for every entry"""
+        ans = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".pkl"):
+                continue
+            f = os.path.join(self.path, name)
+            try:
+                st = os.stat(f)
+            except OSError:
+                # Evicted by another process
+                continue
+            ans.append((st.st_mtime, st.st_size, f))
+        return ans
+
+    def get(self, key):
+        """The cached result for key, or None"""
+        f = self._file(key)
+        try:
+            with open(f, "rb") as fp:
+                value = pickle.load(fp)
+            os.utime(f, None)   # most recently used
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        (fd, tmp) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+        self.size += os.path.getsize(tmp)
+        # rename is atomic, so readers never see a partial entry
+        os.rename(tmp, self._file(key))
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under max_bytes"""
+        entries = sorted(self._entries())
+        self.size = sum(size for (mtime, size, f) in entries)
+        for (mtime, size, f) in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            self.size -= size
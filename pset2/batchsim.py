@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+"""
+Batched engine for swarms made only of Seed and Dummy peers.
+
+Runs many independent iterations of the sim in lockstep as NumPy array
+operations: the blocks every peer has of every piece, in every swarm, is
+one (swarms x peers x pieces) array, and each round's requests, uploads
+and transfers are computed for all swarms at once.  The policies are the
+same as seed.py and dummy.py and the transfer rules the same as
+Sim.run_sim_once, so the results match the reference loop in
+distribution, though not run for run (random numbers are drawn
+differently).
+
+NumPy is optional; available() says whether this can be used.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Agent classes the batched engine knows how to run
+SUPPORTED = set(["Seed", "Dummy"])
+
+# Swarms advanced together; bounds memory use
+BATCH_SIZE = 256
+
+# Most requesters a seed uploads to per round (as in seed.py)
+SEED_MAX_UPLOAD = 4
+
+
+def available():
+    return np is not None
+
+
+def supports(class_names):
+    return set(class_names) <= SUPPORTED
+
+
+def run_batch(config, peer_ids, k, seed):
+    """
+    Run k iterations of config, all at once.
+
+    Returns a list with one (uploaded, completion) pair per iteration, the
+    same dicts Stats.uploaded_blocks and Stats.completion_rounds give:
+    peer_id -> blocks uploaded, and peer_id -> round done (or None).
+    """
+    rng = np.random.RandomState(seed % (1 << 32))
+    names = config.agent_class_names
+    n = len(names)
+    num_pieces = config.num_pieces
+    full_blocks = config.blocks_per_piece
+    max_requests = min(config.max_up_bw / full_blocks + 1, num_pieces)
+
+    is_seed = np.array([name == "Seed" for name in names])
+    seeds = np.flatnonzero(is_seed)
+    dummies = np.flatnonzero(~is_seed)
+    # Ties between uploaders go to the first in peer id order, like the sim
+    order = sorted(range(n), key=lambda i: peer_ids[i])
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    by_rank = np.array(order)
+
+    up_bw = rng.randint(config.min_up_bw, config.max_up_bw + 1, size=(k, n))
+    up_bw[:, is_seed] = config.max_up_bw
+
+    blocks = np.zeros((k, n, num_pieces), dtype=np.int64)
+    blocks[:, is_seed, :] = full_blocks
+    uploaded = np.zeros((k, n), dtype=np.int64)
+    done_round = np.full((k, n), -1, dtype=np.int64)
+    done_round[:, is_seed] = 0
+    if num_pieces == 0:
+        done_round[:] = 0
+
+    rd = 0
+    while True:
+        have = blocks == full_blocks
+        needed = ~have
+        needed[:, seeds, :] = False
+        if not needed.any():
+            break
+
+        # requests[s, i, j]: how many pieces i asks j for.  Dummies ask each
+        # peer for up to max_requests of the pieces it has that they need.
+        overlap = np.matmul(needed.astype(np.int64),
+                            have.astype(np.int64).transpose(0, 2, 1))
+        requests = np.minimum(overlap, max_requests)
+
+        bw = np.zeros((k, n, n), dtype=np.int64)   # [s, to, from]
+        _dummy_uploads(rng, requests, up_bw, dummies, bw)
+        _seed_uploads(rng, requests, up_bw, seeds, bw)
+
+        gained = _transfers(rng, blocks, needed, have, requests, bw,
+                            max_requests, full_blocks, rank, by_rank,
+                            uploaded)
+        blocks += gained
+
+        finished = ((blocks == full_blocks).all(axis=2) &
+                    (done_round == -1))
+        done_round[finished] = rd
+
+        rd += 1
+        if rd > config.max_round:
+            break
+
+    ans = []
+    for s in range(k):
+        ans.append((dict(zip(peer_ids, uploaded[s].tolist())),
+                    dict((pid, r if r >= 0 else None)
+                         for (pid, r) in zip(peer_ids,
+                                             done_round[s].tolist()))))
+    return ans
+
+
+def _dummy_uploads(rng, requests, up_bw, dummies, bw):
+    """
+    Each dummy picks one request at random and gives its requester all its
+    bandwidth: requester i is picked with probability proportional to the
+    number of requests i sent.
+    """
+    if len(dummies) == 0:
+        return
+    weights = requests[:, :, dummies]                 # [s, i, j]
+    cum = weights.cumsum(axis=1)
+    total = cum[:, -1, :]
+    target = rng.random_sample(total.shape) * total
+    chosen = (cum <= target[:, None, :]).sum(axis=1)  # [s, j]
+    (s, j) = np.nonzero(total > 0)
+    bw[s, chosen[s, j], dummies[j]] = up_bw[s, dummies[j]]
+
+
+def _seed_uploads(rng, requests, up_bw, seeds, bw):
+    """
+    Each seed picks up to SEED_MAX_UPLOAD of its requesters at random and
+    splits its bandwidth evenly among them, as util.even_split does: the
+    last (bw % m) picked get one block more.
+    """
+    if len(seeds) == 0:
+        return
+    asked = requests[:, :, seeds] > 0                 # [s, i, j]
+    keys = rng.random_sample(asked.shape)
+    keys[~asked] = 2.0
+    position = keys.argsort(axis=1).argsort(axis=1)   # order picked
+    m = np.minimum(asked.sum(axis=1), SEED_MAX_UPLOAD)  # [s, j]
+    seed_bw = up_bw[:, seeds]
+    base = seed_bw // np.maximum(m, 1)
+    extra = seed_bw % np.maximum(m, 1)
+    picked = position < m[:, None, :]
+    share = base[:, None, :] + (position >= (m - extra)[:, None, :])
+    (s, i, j) = np.nonzero(picked)
+    bw[s, i, seeds[j]] = share[s, i, j]
+
+
+def _transfers(rng, blocks, needed, have, requests, bw, max_requests,
+               full_blocks, rank, by_rank, uploaded):
+    """
+    Resolve the round's uploads.  Each requester asked each uploader for a
+    random sample of the pieces the uploader has; the bandwidth goes to
+    those requests in order.  Blocks of the same piece from several
+    uploaders don't stack: the requester keeps the biggest, credited to
+    that uploader.  Returns the blocks gained, and adds to uploaded.
+    """
+    (s, i, j) = np.nonzero(bw)
+    gained = np.zeros(blocks.shape, dtype=np.int64)
+    if len(s) == 0:
+        return gained
+    n = blocks.shape[1]
+
+    eligible = needed[s, i, :] & have[s, j, :]        # [pair, piece]
+    keys = rng.random_sample(eligible.shape)
+    keys[~eligible] = 2.0
+    pieces = keys.argsort(axis=1)[:, :max_requests]   # requests, in order
+    valid = np.arange(pieces.shape[1])[None, :] < requests[s, i, j][:, None]
+
+    left = bw[s, i, j].copy()
+    # best[s, i, piece]: blocks * (n + 1) + tie breaker, so the max is the
+    # biggest transfer, from the first uploader in peer id order
+    best = np.zeros(blocks.shape, dtype=np.int64)
+    for c in range(pieces.shape[1]):
+        p = pieces[:, c]
+        alloc = np.where(valid[:, c],
+                         np.minimum(left, full_blocks - blocks[s, i, p]), 0)
+        left -= alloc
+        got = alloc > 0
+        np.maximum.at(best, (s[got], i[got], p[got]),
+                      alloc[got] * (n + 1) + (n - rank[j[got]]))
+
+    (bs, bi, bp) = np.nonzero(best)
+    amount = best[bs, bi, bp] // (n + 1)
+    winner = by_rank[n - best[bs, bi, bp] % (n + 1)]
+    gained[bs, bi, bp] = amount
+    np.add.at(uploaded, (bs, winner), amount)
+    return gained
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+"""
+Allocation benchmark for the message types in messages.py.
+
+Compares bytes per message and construction time for the old plain
+classes (one __dict__ per instance) against the slotted ones, and for
+building Downloads one at a time against Download.bulk.
+
+Usage: bench_messages.py [count]
+"""
+
+import sys
+import time
+
+from messages import Upload, Request, Download, PeerInfo
+
+
+# The message classes as they were before they got __slots__.
+class OldUpload:
+    def __init__(self, from_id, to_id, up_bw):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.bw = up_bw
+
+class OldRequest:
+    def __init__(self, requester_id, peer_id, piece_id, start):
+        self.requester_id = requester_id
+        self.peer_id = peer_id
+        self.piece_id = piece_id
+        self.start = start
+
+class OldDownload:
+    def __init__(self, from_id, to_id, piece, blocks):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.piece = piece
+        self.blocks = blocks
+
+class OldPeerInfo:
+    def __init__(self, id, available):
+        self.id = id
+        self.available_pieces = available
+
+
+def size_of(obj):
+    """Bytes used by obj itself, including its __dict__ if it has one"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def timed(f):
+    start = time.time()
+    f()
+    return time.time() - start
+
+def main(args):
+    n = int(args[1]) if len(args) > 1 else 200000
+    avail = set()
+    cases = [("Upload", OldUpload, Upload, ("Peer0", "Peer1", 4)),
+             ("Request", OldRequest, Request, ("Peer0", "Peer1", 3, 0)),
+             ("Download", OldDownload, Download, ("Peer0", "Peer1", 3, 4)),
+             ("PeerInfo", OldPeerInfo, PeerInfo, ("Peer0", avail))]
+
+    print "%-10s %12s %12s %12s %12s" % (
+        "message", "old bytes", "new bytes", "old us/msg", "new us/msg")
+    for (name, old, new, params) in cases:
+        t_old = timed(lambda: [old(*params) for i in xrange(n)])
+        t_new = timed(lambda: [new(*params) for i in xrange(n)])
+        print "%-10s %12d %12d %12.3f %12.3f" % (
+            name, size_of(old(*params)), size_of(new(*params)),
+            1e6 * t_old / n, 1e6 * t_new / n)
+
+    rows = [("Peer0", "Peer1", i % 100, 4) for i in xrange(n)]
+    t_loop = timed(lambda: [Download(*r) for r in rows])
+    t_bulk = timed(lambda: Download.bulk(rows))
+    print
+    print "Download x %d: %.3f us/msg one at a time, %.3f us/msg bulk" % (
+        n, 1e6 * t_loop / n, 1e6 * t_bulk / n)
+
+if __name__ == "__main__":
+    main(sys.argv)
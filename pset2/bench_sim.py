@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+"""
+Scenario benchmarks for sim.py.
+
+Runs a fixed matrix of swarm sizes, file shapes (num_pieces x
+blocks_per_piece) and agent mixes, each in a fresh process, and records
+wall time per round, time per round phase and peak memory.
+
+  bench_sim.py --out bench_baseline.json    record a baseline
+  bench_sim.py --compare bench_baseline.json
+                                            run again and flag regressions
+  bench_sim.py --compare bench_baseline.json --current other.json
+                                            compare two saved runs
+
+bench_baseline.json is the recorded baseline.  Timings depend on the
+machine, so record your own before comparing on a different one.
+"""
+
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+SWARM_SIZES = [10, 30, 60]
+# (num_pieces, blocks_per_piece)
+FILE_SHAPES = [(16, 4), (64, 8)]
+MAX_ROUND = 300
+MIN_BW = 4
+MAX_BW = 10
+SEED = 136
+
+def mix(others):
+    """Agent mix with one seed per 10 peers and the rest split among others"""
+    def agents(n):
+        seeds = max(1, n / 10)
+        counts = [(n - seeds) / len(others)] * len(others)
+        for i in range((n - seeds) % len(others)):
+            counts[i] += 1
+        return [("Seed", seeds)] + zip(others, counts)
+    return agents
+
+AGENT_MIXES = [
+    ("builtin", mix(["Dummy"])),
+    ("std", mix(["MewtStd"])),
+    ("mixed", mix(["Dummy", "MewtStd", "MewtTyrant", "MewtPropShare",
+                   "MewtTourney"])),
+    ]
+
+# Metrics compared between runs; all are "lower is better".
+METRICS = ["seconds_per_round", "peak_kb"]
+
+
+def scenarios():
+    """Return the benchmark matrix as a list of (name, params) pairs"""
+    ans = []
+    for (mix_name, agents) in AGENT_MIXES:
+        for n in SWARM_SIZES:
+            for (num_pieces, blocks_per_piece) in FILE_SHAPES:
+                name = "%s-n%d-p%dx%d" % (mix_name, n, num_pieces,
+                                          blocks_per_piece)
+                ans.append((name, dict(agents=agents(n),
+                                       num_pieces=num_pieces,
+                                       blocks_per_piece=blocks_per_piece)))
+    return ans
+
+
+def run_one(params):
+    """Run one scenario in this process and return its measurements"""
+    from util import Params, load_modules
+    from sim import Sim
+
+    names = []
+    for (class_name, count) in params["agents"]:
+        names.extend([class_name] * count)
+
+    config = Params()
+    config.add("agent_class_names", names)
+    config.add("agent_classes", load_modules(names))
+    config.add("num_pieces", params["num_pieces"])
+    config.add("blocks_per_piece", params["blocks_per_piece"])
+    config.add("max_round", MAX_ROUND)
+    config.add("min_up_bw", MIN_BW)
+    config.add("max_up_bw", MAX_BW)
+    config.add("iters", 1)
+    config.add("workers", 1)
+    config.add("seed", SEED)
+    config.add("trusted_agents", False)
+    config.add("trace", None)
+    config.add("profile", None)
+    config.add("history_window", None)
+    config.add("call_budget", None)
+
+    random.seed(SEED)
+    sim = Sim(config)
+    start = time.time()
+    sim.run_sim_once()
+    seconds = time.time() - start
+
+    rounds = len(sim.round_times)
+    return dict(rounds=rounds,
+                seconds=seconds,
+                seconds_per_round=seconds / rounds,
+                max_round_seconds=max(sim.round_times),
+                phase_seconds_per_round=dict(
+                    (phase, t / rounds)
+                    for (phase, t) in sim.phase_times.items()),
+                peak_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run_all(only):
+    """Run every scenario whose name contains only, each in a subprocess"""
+    results = dict()
+    for (name, params) in scenarios():
+        if only and only not in name:
+            continue
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-one", name]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        out = p.communicate()[0]
+        if p.returncode != 0:
+            logging.warning("%s: failed (exit %d)" % (name, p.returncode))
+            results[name] = dict(error=p.returncode)
+            continue
+        # Agents log, at most, so stdout is just the measurements
+        results[name] = json.loads(out)
+        logging.warning("%-28s %4d rounds  %8.2f ms/round  %8d KB" % (
+            name, results[name]["rounds"],
+            1000 * results[name]["seconds_per_round"],
+            results[name]["peak_kb"]))
+    return results
+
+
+def compare(baseline, current, threshold):
+    """
+    Return a list of (scenario, metric, old, new) for every metric that got
+    worse by more than threshold (a fraction).
+    """
+    regressions = []
+    for name in sorted(baseline):
+        old = baseline[name]
+        new = current.get(name)
+        if new is None or "error" in old or "error" in new:
+            continue
+        pairs = [(m, old[m], new[m]) for m in METRICS]
+        for phase in old["phase_seconds_per_round"]:
+            pairs.append(("phase:" + phase,
+                          old["phase_seconds_per_round"][phase],
+                          new["phase_seconds_per_round"].get(phase, 0)))
+        for (metric, a, b) in pairs:
+            if a > 0 and b > a * (1 + threshold):
+                regressions.append((name, metric, a, b))
+    return regressions
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--out", dest="out", default=None,
+                      help="Write results to this JSON file")
+    parser.add_option("--compare", dest="baseline", default=None,
+                      help="Baseline JSON file to compare against")
+    parser.add_option("--current", dest="current", default=None,
+                      help="Compare this JSON file instead of running")
+    parser.add_option("--threshold", dest="threshold", default=0.10,
+                      type="float",
+                      help="Flag metrics more than this fraction worse")
+    parser.add_option("--only", dest="only", default=None,
+                      help="Only run scenarios whose name contains this")
+    parser.add_option("--run-one", dest="run_one", default=None,
+                      help=SUPPRESS_HELP)
+    (options, args) = parser.parse_args(args[1:])
+
+    logging.basicConfig(format="%(message)s")
+
+    if options.run_one:
+        logging.getLogger('').setLevel(logging.ERROR)
+        params = dict(scenarios())[options.run_one]
+        print json.dumps(run_one(params))
+        return 0
+
+    if options.current:
+        current = json.load(open(options.current))
+    else:
+        current = run_all(options.only)
+    if options.out:
+        with open(options.out, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        regressions = compare(baseline, current, options.threshold)
+        for (name, metric, a, b) in regressions:
+            logging.warning("REGRESSION %s %s: %.6g -> %.6g (%+.0f%%)" % (
+                name, metric, a, b, 100.0 * (b - a) / a))
+        if regressions:
+            return 1
+        logging.warning("No regressions beyond %.0f%%" %
+                        (100 * options.threshold))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+import math
+import signal
+import threading
+from array import array
+from contextlib import contextmanager
+
+
+class AgentTimeout(Exception):
+    """Raised inside an agent call that ran past its time budget"""
+    pass
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Raise AgentTimeout in the block if it runs longer than seconds.  Only
+    possible in the main thread of platforms with setitimer; elsewhere the
+    block runs to completion and the caller has to check the time itself.
+    """
+    if (seconds is None or not hasattr(signal, "setitimer") or
+        not isinstance(threading.current_thread(), threading._MainThread)):
+        yield
+        return
+
+    def expired(signum, frame):
+        raise AgentTimeout()
+    old = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old)
+
+
+class TimeHistogram:
+    """
+    Call times binned into log-spaced buckets, plus the exact count and
+    max.  Fixed size however many calls are added, and histograms from
+    different processes add up.  Percentiles are the upper edge of their
+    bucket, so at most 2 ** (1.0 / BUCKETS_PER_DOUBLING) (about 9%) high.
+    """
+    MIN_SECONDS = 1e-6
+    BUCKETS_PER_DOUBLING = 8
+    # Bucket 0 is everything up to MIN_SECONDS; the last is everything
+    # over about 4.5 minutes
+    NUM_BUCKETS = 2 + 28 * BUCKETS_PER_DOUBLING
+
+    def __init__(self):
+        self.counts = array('l', [0] * TimeHistogram.NUM_BUCKETS)
+        self.count = 0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket(seconds):
+        if seconds <= TimeHistogram.MIN_SECONDS:
+            return 0
+        b = 1 + int(math.log(seconds / TimeHistogram.MIN_SECONDS, 2) *
+                    TimeHistogram.BUCKETS_PER_DOUBLING)
+        return min(b, TimeHistogram.NUM_BUCKETS - 1)
+
+    @staticmethod
+    def upper(b):
+        """The largest time in bucket b"""
+        return TimeHistogram.MIN_SECONDS * 2 ** (
+            float(b) / TimeHistogram.BUCKETS_PER_DOUBLING)
+
+    def add(self, seconds):
+        self.counts[TimeHistogram.bucket(seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for (b, c) in enumerate(other.counts):
+            self.counts[b] += c
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """Seconds (nearest rank), from the bucket it falls in"""
+        rank = max(1, -(-p * self.count // 100))
+        seen = 0
+        for (b, c) in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(TimeHistogram.upper(b), self.max)
+        return self.max
+
+
+class CallTimes:
+    """
+    How long every agent's requests() and uploads() calls took, and which
+    calls went over the time budget.  Times are kept as a TimeHistogram per
+    agent and method, so this stays small however long the runs are.
+    """
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self):
+        self.times = dict()      # (peer_id, method) -> TimeHistogram
+        self.class_of = dict()   # peer_id -> class name
+        self.overruns = []       # [(run, round, peer_id, method, seconds)]
+        self.runs = 0
+
+    def add(self, peer_id, class_name, method, seconds):
+        key = (peer_id, method)
+        if key not in self.times:
+            self.times[key] = TimeHistogram()
+            self.class_of[peer_id] = class_name
+        self.times[key].add(seconds)
+
+    def overrun(self, rd, peer_id, method, seconds):
+        self.overruns.append((self.runs, rd, peer_id, method, seconds))
+
+    def end_run(self):
+        self.runs += 1
+
+    def merge(self, other):
+        for ((peer_id, method), times) in other.times.items():
+            key = (peer_id, method)
+            if key not in self.times:
+                self.times[key] = TimeHistogram()
+                self.class_of[peer_id] = other.class_of[peer_id]
+            self.times[key].merge(times)
+        self.overruns.extend((self.runs + run, rd, peer_id, method, seconds)
+                             for (run, rd, peer_id, method, seconds)
+                             in other.overruns)
+        self.runs += other.runs
+        return self
+
+    @staticmethod
+    def percentiles(times):
+        """dict : percentile -> seconds, plus "max", for a TimeHistogram"""
+        ans = dict((p, times.percentile(p)) for p in CallTimes.PERCENTILES)
+        ans["max"] = times.max
+        return ans
+
+    def by_class(self):
+        """dict : (class name, method) -> TimeHistogram of all the calls"""
+        ans = dict()
+        for ((peer_id, method), times) in self.times.items():
+            key = (self.class_of[peer_id], method)
+            ans.setdefault(key, TimeHistogram()).merge(times)
+        return ans
+
+    def table(self, slowest=5):
+        """
+        Summary lines: percentiles per class and method, the slowest agents,
+        and the calls that went over budget.
+        """
+        header = "%-30s %8s" % ("class / agent call", "calls") + "".join(
+            "%10s" % ("p%d ms" % p) for p in CallTimes.PERCENTILES) + (
+            "%10s" % "max ms")
+        def row(name, times):
+            ps = CallTimes.percentiles(times)
+            return "%-30s %8d" % (name, times.count) + "".join(
+                "%10.3f" % (1000 * ps[p])
+                for p in CallTimes.PERCENTILES + ["max"])
+
+        rows = [header]
+        for ((class_name, method), times) in sorted(self.by_class().items()):
+            rows.append(row("%s.%s" % (class_name, method), times))
+        rows.append("Slowest agents (by max):")
+        worst = sorted(self.times.items(), key=lambda (k, ts): -ts.max)
+        for ((peer_id, method), times) in worst[:slowest]:
+            rows.append(row("%s.%s" % (peer_id, method), times))
+        if self.overruns:
+            counts = dict()
+            for (run, rd, peer_id, method, seconds) in self.overruns:
+                key = "%s.%s" % (peer_id, method)
+                counts[key] = counts.get(key, 0) + 1
+            rows.append("Over budget (calls ignored): " + ", ".join(
+                "%s x%d" % (k, counts[k]) for k in sorted(counts)))
+        return "\n".join(rows)
@@ -1,7 +1,314 @@
 #!/usr/bin/python
 
-import copy
 import pprint
+from array import array
+from collections import deque
+from itertools import islice, izip
+
+from messages import Upload, Download
+from spill import SpillLog
+
+
+class RoundRows:
+    """
+    One round of messages, stored column-wise.
+
+    Each field is a parallel array with one row per message.  Peer id fields
+    (the ones ending in "_id") are stored as indexes into peer_ids.  Rows are
+    grouped by owner -- the peer whose history they belong to -- so
+    starts[i]:ends[i] are owner i's rows.  If there is an "other" field,
+    other_rows lists row numbers grouped by it, indexed the same way.
+    """
+    def __init__(self, cols, starts, ends, other=None):
+        self.cols = cols
+        self.starts = starts
+        self.ends = ends
+        self.other = other   # (other_rows, other_starts, other_ends)
+
+    def arrays(self, fields):
+        """Everything as a list of arrays, for the spill log"""
+        ans = [self.cols[f] for f in fields] + [self.starts, self.ends]
+        if self.other is not None:
+            ans.extend(self.other)
+        return ans
+
+    @staticmethod
+    def from_arrays(fields, arrays):
+        n = len(fields)
+        other = tuple(arrays[n + 2:]) or None
+        return RoundRows(dict(zip(fields, arrays[:n])),
+                         arrays[n], arrays[n + 1], other)
+
+
+class Columns:
+    """
+    Columnar store for one kind of message (Downloads or Uploads): one
+    RoundRows per round.
+
+    If a SpillLog is given, only the last `window` rounds stay in memory.
+    Older rounds are written to the log and paged back in when read.
+    """
+    # How many paged-in rounds to keep around
+    PAGE_CACHE = 8
+
+    def __init__(self, peer_ids, fields, owner, other, make,
+                 window=None, spill=None):
+        """
+        fields: attribute names, in the order make() takes them
+        owner: field the rows are grouped by
+        other: field to keep a second index on, or None
+        make: the message class (a messages.Message)
+        """
+        self.peer_ids = peer_ids
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.fields = fields
+        self.make = make
+        self.owner = owner
+        self.other = other
+        self.window = window
+        self.spill = spill
+
+        # round -> RoundRows, or a spill log handle once spilled
+        self.round_rows = []
+        self.spilled = 0   # rounds before this one are on disk
+        self.paged = dict()   # round -> RoundRows read back from disk
+        # Blocks / column types: some agents upload fractional bandwidth,
+        # so numeric columns widen to doubles when they have to.
+        self.typecodes = dict((f, 'i') for f in fields)
+
+    def num_rounds(self):
+        return len(self.round_rows)
+
+    def append_round(self, msgs):
+        """
+        msgs: dict : owner peer id -> list of messages for the round
+        """
+        cols = dict((f, array(self.typecodes[f])) for f in self.fields)
+        starts = array('i')
+        ends = array('i')
+        n = 0
+        for pid in self.peer_ids:
+            starts.append(n)
+            for m in msgs[pid]:
+                for f in self.fields:
+                    self._append(cols, f, getattr(m, f))
+                n += 1
+            ends.append(n)
+
+        other = None
+        if self.other is not None:
+            buckets = [[] for pid in self.peer_ids]
+            for (row, i) in enumerate(cols[self.other]):
+                buckets[i].append(row)
+            other = (array('i'), array('i'), array('i'))
+            for rows in buckets:
+                other[1].append(len(other[0]))
+                other[0].extend(rows)
+                other[2].append(len(other[0]))
+
+        self.round_rows.append(RoundRows(cols, starts, ends, other))
+        self._spill_old_rounds()
+
+    def _append(self, cols, field, value):
+        if field.endswith("_id"):
+            cols[field].append(self.index[value])
+            return
+        if isinstance(value, float) and self.typecodes[field] == 'i':
+            self.typecodes[field] = 'd'
+            cols[field] = array('d', cols[field])
+        cols[field].append(value)
+
+    def _spill_old_rounds(self):
+        if self.spill is None:
+            return
+        while self.num_rounds() - self.spilled > self.window:
+            rd = self.spilled
+            arrays = self.round_rows[rd].arrays(self.fields)
+            self.round_rows[rd] = self.spill.append(arrays)
+            self.spilled += 1
+
+    def get(self, rd):
+        """The RoundRows for round rd, paging it in if it was spilled"""
+        if rd >= self.spilled:
+            return self.round_rows[rd]
+        if rd not in self.paged:
+            if len(self.paged) >= Columns.PAGE_CACHE:
+                self.paged.clear()
+            arrays = self.spill.read(self.round_rows[rd])
+            self.paged[rd] = RoundRows.from_arrays(self.fields, arrays)
+        return self.paged[rd]
+
+    def column(self, field, peer_id, rd):
+        """
+        The values of one field for peer_id's rows in round rd.  Peer id
+        fields come back as peer ids.
+        """
+        rows = self.get(rd)
+        i = self.index[peer_id]
+        col = rows.cols[field][rows.starts[i]:rows.ends[i]]
+        if field.endswith("_id"):
+            return [self.peer_ids[j] for j in col]
+        return col
+
+    def _args(self, rows, row):
+        args = []
+        for f in self.fields:
+            v = rows.cols[f][row]
+            if f.endswith("_id"):
+                v = self.peer_ids[v]
+            args.append(v)
+        return args
+
+    def messages(self, peer_id, rd):
+        """peer_id's messages for round rd"""
+        rows = self.get(rd)
+        i = self.index[peer_id]
+        return self.make.bulk(self._args(rows, row)
+                              for row in xrange(rows.starts[i], rows.ends[i]))
+
+    def other_messages(self, peer_id, rd):
+        """The messages in round rd whose other field is peer_id"""
+        rows = self.get(rd)
+        (other_rows, starts, ends) = rows.other
+        i = self.index[peer_id]
+        return self.make.bulk(self._args(rows, row)
+                              for row in other_rows[starts[i]:ends[i]])
+
+
+class RoundsView:
+    """
+    Read-only, list-like view of one peer's messages: view[rd] is the list
+    of messages for round rd.  Grows as the history does.
+
+    Rounds never change once added, so the messages built for the last
+    few rounds read are kept; agents mostly look at the same recent rounds
+    over and over.
+    """
+    def __init__(self, columns, peer_id):
+        self.columns = columns
+        self.peer_id = peer_id
+        self.built = dict()   # round -> messages
+
+    def __len__(self):
+        return self.columns.num_rounds()
+
+    def __getitem__(self, rd):
+        if isinstance(rd, slice):
+            return [self[r] for r in xrange(*rd.indices(len(self)))]
+        n = len(self)
+        if rd < 0:
+            rd += n
+        if rd < 0 or rd >= n:
+            raise IndexError("round %d out of range" % rd)
+        if rd not in self.built:
+            if len(self.built) >= Columns.PAGE_CACHE:
+                self.built.clear()
+            self.built[rd] = self.columns.messages(self.peer_id, rd)
+        # A fresh list, so an agent changing it doesn't change the history
+        return list(self.built[rd])
+
+    def __iter__(self):
+        for rd in xrange(len(self)):
+            yield self[rd]
+
+    def __repr__(self):
+        return pprint.pformat(list(self))
+
+
+class Received:
+    """
+    Running totals of the blocks one peer has received, by uploader.
+
+    Kept up to date by History.update, so agents can ask "how much did j
+    send me lately" without walking back through the rounds.  Each recent
+    round's blocks by uploader are kept, along with their sum, which is
+    updated as rounds come and go: the last n rounds are the sum of the
+    last n of them.  The number of rounds kept grows to the longest
+    lookback asked for.
+    """
+    # How many rounds to keep, until a longer lookback is asked for
+    INITIAL_WINDOW = 10
+
+    def __init__(self):
+        self.total = dict()    # uploader -> blocks, whole history
+        self.streak = dict()   # uploader -> consecutive rounds, up to the last
+        self.rounds = 0
+        self.window = Received.INITIAL_WINDOW
+        # uploader -> blocks for each of the last self.window rounds,
+        # oldest first
+        self.deltas = deque()
+        # uploader -> blocks over the rounds in self.deltas, and in how
+        # many of them they sent something
+        self.recent = dict()
+        self.recent_rounds = dict()
+
+    def add_round(self, downloads):
+        delta = dict()
+        for d in downloads:
+            delta[d.from_id] = delta.get(d.from_id, 0) + d.blocks
+        for (pid, blocks) in delta.iteritems():
+            self.total[pid] = self.total.get(pid, 0) + blocks
+            self.recent[pid] = self.recent.get(pid, 0) + blocks
+            self.recent_rounds[pid] = self.recent_rounds.get(pid, 0) + 1
+        self.streak = dict((pid, self.streak.get(pid, 0) + 1)
+                           for pid in delta)
+        self.rounds += 1
+        self.deltas.append(delta)
+        while len(self.deltas) > self.window:
+            self._evict()
+
+    def _evict(self):
+        for (pid, blocks) in self.deltas.popleft().iteritems():
+            self.recent_rounds[pid] -= 1
+            if self.recent_rounds[pid] == 0:
+                # Dropped outright, so float blocks leave nothing behind
+                del self.recent[pid]
+                del self.recent_rounds[pid]
+            else:
+                self.recent[pid] -= blocks
+
+    def _last(self, n):
+        """
+        The deltas for the last n rounds, all of them if n covers the whole
+        history, or None if that's further back than the rounds kept.
+        """
+        if n > len(self.deltas) and n < self.rounds:
+            return None
+        return islice(self.deltas, max(0, len(self.deltas) - max(n, 0)),
+                      None)
+
+    def received_in_last(self, n):
+        """
+        uploader -> blocks received in the last n rounds, or None if that's
+        further back than the rounds kept.
+        """
+        if n >= self.rounds:
+            return dict(self.total)
+        if n == len(self.deltas):
+            return dict(self.recent)
+        deltas = self._last(n)
+        if deltas is None:
+            return None
+        ans = dict()
+        for delta in deltas:
+            for (pid, blocks) in delta.iteritems():
+                ans[pid] = ans.get(pid, 0) + blocks
+        return ans
+
+    def received_from(self, uploader_id, n):
+        """Like received_in_last(n)[uploader_id], without the whole dict"""
+        if n >= self.rounds:
+            return self.total.get(uploader_id, 0)
+        if n == len(self.deltas):
+            return self.recent.get(uploader_id, 0)
+        deltas = self._last(n)
+        if deltas is None:
+            return None
+        return sum(delta.get(uploader_id, 0) for delta in deltas)
+
+    def keep(self, n):
+        """Keep enough rounds to look back n rounds from now on"""
+        self.window = max(self.window, n)
 
 
 class AgentHistory:
@@ -10,18 +317,22 @@ class AgentHistory:
 
     history.downloads: [[Download objects for round]]  (one sublist for each round)
          All the downloads _to_ this agent.
-        
+
     history.uploads: [[Upload objects for round]]  (one sublist for each round)
          All the downloads _from_ this agent.
 
+    Both are views over the sim's History, not copies.  received_from(),
+    received_in_last() and unchoked_streak() answer the usual reciprocation
+    questions from running totals.
     """
-    def __init__(self, peer_id, downloads, uploads):
+    def __init__(self, peer_id, downloads, uploads, received=None):
         """
         Pull out just the info for peer_id.
         """
         self.uploads = uploads
         self.downloads = downloads
         self.peer_id = peer_id
+        self.received = received
 
     def last_round(self):
         return len(self.downloads)-1
@@ -30,6 +341,61 @@ class AgentHistory:
         """ 0 is the first """
         return len(self.downloads)
 
+    def download_columns(self, rd):
+        """
+        Downloads to this agent in round rd as parallel lists:
+        (from_ids, pieces, blocks).  Cheaper than building Download objects.
+        """
+        cols = self.downloads.columns
+        return (cols.column("from_id", self.peer_id, rd),
+                cols.column("piece", self.peer_id, rd),
+                cols.column("blocks", self.peer_id, rd))
+
+    def _scan(self, n, uploader_id=None):
+        """
+        What was received in the last n rounds, by uploader (or just from
+        uploader_id), the slow way: for lookbacks further back than the
+        rounds kept.  Keeps enough rounds for next time.
+        """
+        self.received.keep(n)
+        ans = dict()
+        last = len(self.downloads)
+        for rd in xrange(last - n, last):
+            (from_ids, pieces, blocks) = self.download_columns(rd)
+            for (pid, b) in izip(from_ids, blocks):
+                if uploader_id is None or pid == uploader_id:
+                    ans[pid] = ans.get(pid, 0) + b
+        return ans
+
+    def received_in_last(self, n=None):
+        """
+        dict : uploader id -> blocks received from them in the last n rounds,
+        or over the whole history if n is None.
+        """
+        if n is None:
+            return dict(self.received.total)
+        ans = self.received.received_in_last(n)
+        if ans is None:
+            ans = self._scan(n)
+        return dict((pid, blocks) for (pid, blocks) in ans.iteritems()
+                    if blocks != 0)
+
+    def received_from(self, uploader_id, n=None):
+        """Blocks received from uploader_id in the last n rounds, or ever"""
+        if n is None:
+            return self.received.total.get(uploader_id, 0)
+        ans = self.received.received_from(uploader_id, n)
+        if ans is None:
+            ans = self._scan(n, uploader_id).get(uploader_id, 0)
+        return ans
+
+    def unchoked_streak(self, uploader_id):
+        """
+        Number of rounds in a row, up to the last one, that uploader_id sent
+        this peer something.  0 if they didn't last round.
+        """
+        return self.received.streak.get(uploader_id, 0)
+
     def __repr__(self):
         return "AgentHistory(downloads=%s, uploads=%s)" % (
             pprint.pformat(self.downloads),
@@ -38,22 +404,42 @@ class AgentHistory:
 
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, window=None):
         """
         uploads:
                    dict : peer_id -> [[uploads] -- one list per round]
         downloads:
                    dict : peer_id -> [[downloads] -- one list per round]
-                   
+
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
+
+        Stored column-wise (see Columns); the dicts above hold views.
+
+        window: if set, only keep the last `window` rounds in memory and
+        spill older ones to a temporary file.  Every round stays readable.
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
         self.peer_ids = peer_ids[:]
 
         self.round_done = dict()   # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        self.spill = SpillLog() if window is not None else None
+        self.download_columns = Columns(
+            self.peer_ids, ("from_id", "to_id", "piece", "blocks"),
+            owner="to_id", other="from_id", make=Download,
+            window=window, spill=self.spill)
+        self.upload_columns = Columns(
+            self.peer_ids, ("from_id", "to_id", "bw"),
+            owner="from_id", other=None, make=Upload,
+            window=window, spill=self.spill)
+        # peer_id -> blocks uploaded so far
+        self.uploaded = dict((pid, 0) for pid in peer_ids)
+        # peer_id -> Received
+        self.received = dict((pid, Received()) for pid in peer_ids)
+        self.downloads = dict((pid, RoundsView(self.download_columns, pid))
+                              for pid in peer_ids)
+        self.uploads = dict((pid, RoundsView(self.upload_columns, pid))
+                            for pid in peer_ids)
 
     def update(self, dls, ups):
         """
@@ -62,9 +448,12 @@ class History:
 
         append these downloads to to the history
         """
+        self.download_columns.append_round(dls)
+        self.upload_columns.append_round(ups)
         for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+            for d in dls[pid]:
+                self.uploaded[d.from_id] += d.blocks
+            self.received[pid].add_round(dls[pid])
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
@@ -72,27 +461,38 @@ class History:
             self.round_done[peer_id] = round
 
     def peer_history(self, peer_id):
-        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
+        return AgentHistory(peer_id, self.downloads[peer_id],
+                            self.uploads[peer_id], self.received[peer_id])
+
+    def uploaded_blocks(self):
+        """dict : peer_id -> total blocks uploaded over the whole history"""
+        return dict(self.uploaded)
+
+    def downloads_from(self, peer_id, rd):
+        """List of the Downloads uploaded by peer_id in round rd"""
+        return self.download_columns.other_messages(peer_id, rd)
+
+    def close(self):
+        """Remove the spill file, if any"""
+        if self.spill is not None:
+            self.spill.close()
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p])-1
+        return self.download_columns.num_rounds()-1
 
     def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
+        lines = ["\nRound %s:\n" % r]
         for peer_id in self.peer_ids:
             ds = self.downloads[peer_id][r]
             stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
                 peer_id, d.blocks, d.piece, d.from_id)
-            s += "".join(map(stringify, ds))
-        return s
+            lines.extend(map(stringify, ds))
+        return "".join(lines)
 
     def pretty(self):
-        s = "History\n"
-        for r in range(self.last_round()+1):
-            s += self.pretty_for_round(r)
-        return s
+        return "History\n" + "".join(self.pretty_for_round(r)
+                                     for r in range(self.last_round()+1))
 
     def __repr__(self):
         return """History(
@@ -101,4 +501,3 @@ downloads=%s
 )""" % (
     pprint.pformat(self.uploads),
     pprint.pformat(self.downloads))
-
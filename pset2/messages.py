@@ -1,35 +1,80 @@
 #!/usr/bin/python
 
-class Upload:
+# Messages are allocated by the hundred thousand and Downloads live in the
+# History for the whole run, so they use __slots__ (no per-instance __dict__)
+# and are immutable once built.
+
+class Message(object):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    def bulk(cls, rows):
+        """
+        Build one message per tuple of constructor arguments in rows.
+        Skips __init__, so it is much cheaper than calling cls() in a loop.
+        """
+        new = object.__new__
+        setters = [getattr(cls, f).__set__ for f in cls.__slots__]
+        msgs = []
+        for row in rows:
+            m = new(cls)
+            for (s, v) in zip(setters, row):
+                s(m, v)
+            msgs.append(m)
+        return msgs
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in self.__slots__)
+
+    def __setstate__(self, state):
+        for (f, v) in zip(self.__slots__, state):
+            object.__setattr__(self, f, v)
+
+
+class Upload(Message):
+    __slots__ = ("from_id", "to_id", "bw")
+
     def __init__(self, from_id, to_id, up_bw):
-        self.from_id = from_id
-        self.to_id = to_id
-        self.bw = up_bw
+        put = object.__setattr__
+        put(self, "from_id", from_id)
+        put(self, "to_id", to_id)
+        put(self, "bw", up_bw)
 
     def __repr__(self):
         return "Upload(from_id = %s, to_id=%s, bw=%d)" % (
             self.from_id, self.to_id, self.bw)
 
-class Request:
+class Request(Message):
+    __slots__ = ("requester_id", "peer_id", "piece_id", "start")
+
     def __init__(self, requester_id, peer_id, piece_id, start):
-        self.requester_id = requester_id
-        self.peer_id = peer_id   # peer data is requested from
-        self.piece_id = piece_id
-        self.start = start  # the block index
+        put = object.__setattr__
+        put(self, "requester_id", requester_id)
+        put(self, "peer_id", peer_id)   # peer data is requested from
+        put(self, "piece_id", piece_id)
+        put(self, "start", start)  # the block index
 
     def __repr__(self):
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
-class Download:
+class Download(Message):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
+    __slots__ = ("from_id", "to_id", "piece", "blocks")
+
     def __init__(self, from_id, to_id, piece, blocks):
-        self.from_id = from_id  # who did the agent download from?
-        self.to_id = to_id      # Who downloaded?
-        self.piece = piece      # Which piece?
-        self.blocks = blocks    # How much did the agent download?
+        put = object.__setattr__
+        put(self, "from_id", from_id)  # who did the agent download from?
+        put(self, "to_id", to_id)      # Who downloaded?
+        put(self, "piece", piece)      # Which piece?
+        put(self, "blocks", blocks)    # How much did the agent download?
 
     def __repr__(self):
         return "Download(from_id=%s, to_id=%s, piece=%d, blocks=%d)" % (
@@ -37,16 +82,18 @@ class Download:
 
 
 
-            
-class PeerInfo:
+
+class PeerInfo(Message):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
     """
+    __slots__ = ("id", "available_pieces")
+
     def __init__(self, id, available):
-        self.id = id
-        self.available_pieces = available
+        put = object.__setattr__
+        put(self, "id", id)
+        put(self, "available_pieces", available)
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
-
@@ -10,7 +10,7 @@ from mewtstd import MewtStd
 
 class MewtPropShare(MewtStd):
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        logging.debug("post_init(): %s here!", self.id)
         self.dummy_state = dict()
         self.dummy_state["cake"] = "lie"
     
@@ -40,22 +40,15 @@ class MewtPropShare(MewtStd):
             if request.requester_id not in requesting_peers:
                 requesting_peers.append(request.requester_id)
 
-        previous_round = round - 1
-        downloads = history.downloads[previous_round]
-        # dictionary of {requester: amt uploaded to peer i, ... }
+        # dictionary of {requester: amt uploaded to peer i in the last round, ... }
         amt_uploaded = {}
         total_uploaded_by_requesting_peers = 0
         unchoked_peers = set()
-        for download in downloads:
-            peer_id = download.from_id
-            blocks = download.blocks
+        for (peer_id, blocks) in history.received_in_last(1).items():
             if peer_id in requesting_peers:
                 total_uploaded_by_requesting_peers += blocks
                 unchoked_peers.add(peer_id)
-                if peer_id in amt_uploaded:
-                    amt_uploaded[peer_id] += blocks
-                else:
-                    amt_uploaded[peer_id] = blocks
+                amt_uploaded[peer_id] = blocks
 
         bws = []
         for uc_peer in unchoked_peers:
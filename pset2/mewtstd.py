@@ -11,8 +11,11 @@ from util import even_split
 from peer import Peer
 
 class MewtStd(Peer):
+    # Keep self.needed_pieces() up to date instead of copying self.pieces
+    uses_piece_deltas = True
+
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        logging.debug("post_init(): %s here!", self.id)
         self.dummy_state = dict()
         self.dummy_state["cake"] = "lie"
         self.optimistically_unchoked_peer = None
@@ -26,8 +29,7 @@ class MewtStd(Peer):
 
         This will be called after update_pieces() with the most recent state.
         """
-        needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
-        needed_pieces = filter(needed, range(len(self.pieces)))
+        needed_pieces = sorted(self.needed_pieces())
         np_set = set(needed_pieces)  # sets support fast intersection ops.
 
         requests = []   # We'll put all the things we want here
@@ -36,9 +38,10 @@ class MewtStd(Peer):
 
         random.shuffle(peers)
 
-        sorted_np_count_lst = pieceAvailabilityCount2(peers, needed_pieces)
-        if sorted_np_count_lst == None:
-            print "No Requests: None of pieces needed are available"
+        # [(count, [pieces]), ...] rarest first, kept up to date by the sim
+        sorted_np_count_lst = peers.availability.rarest(needed_pieces)
+        if not sorted_np_count_lst:
+            logging.debug("No Requests: None of pieces needed are available")
             return requests
 
 
@@ -149,72 +152,11 @@ class MewtStd(Peer):
         return uploads
 
 
-# return piece availability count for all needed pieces
-def pieceAvailabilityCount(peers, needed_pieces):
-    # create piece: count dictionary
-    piece_count_dict = {}
-
-    check_pieces_available = False;
-    for p in peers:
-        for piece in p.available_pieces:
-            if (piece in needed_pieces):
-                if piece in piece_count_dict:
-                    piece_count_dict[piece] += 1
-                else:
-                    piece_count_dict[piece] = 1
-                    check_pieces_available = True
-
-    if (check_pieces_available == False):
-        print "None of pieces needed are available"
-        return None
-
-    return piece_count_dict
-
-
-def pieceAvailabilityCount2(peers, needed_pieces):
-    # create count: [piece, piece] dictionary
-
-    piece_count_dict = pieceAvailabilityCount(peers, needed_pieces)
-
-    if piece_count_dict == None: 
-        return None
-
-    count_piece_dict = {}
-
-
-    for piece, count in piece_count_dict.items():
-        if count in count_piece_dict:
-            count_piece_dict[count].append(piece)
-        else:
-            count_piece_dict[count] = [piece]
-
-    sorted_list = sorted(count_piece_dict.items())
-    return sorted_list
-
 # find how much each requesting_peer has downloaded to Agent in last n rounds
 def findPeerByDownloadRateInLastNRounds(n, self, requesting_peers, history):
-    rd  = history.current_round() - 1
-    downloads_by_agent = history.downloads
-
-    peer_upload_to_agent_dict = {}
-
-    while (n > 0 and rd >= 0):
-        for download in downloads_by_agent[rd]:
-            if (download.from_id in requesting_peers and download.to_id == self.id):
-                from_peer = download.from_id
-
-                # track how many blocks that agent received from peer in this rd
-                if (from_peer in peer_upload_to_agent_dict):
-                    peer_upload_to_agent_dict[from_peer] += download.blocks
-                else:
-                    peer_upload_to_agent_dict[from_peer] = download.blocks
-
-        # decrease the round
-        rd-= 1
-        # decrease n
-        n -= 1
-
-    return peer_upload_to_agent_dict
+    received = history.received_in_last(n)
+    return dict((peer_id, blocks) for (peer_id, blocks) in received.items()
+                if peer_id in requesting_peers)
 
 
 
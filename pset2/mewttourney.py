@@ -14,7 +14,7 @@ from mewtstd import MewtStd
 
 class MewtTourney(MewtStd):
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        logging.debug("post_init(): %s here!", self.id)
         self.dummy_state = dict()
         self.dummy_state["cake"] = "lie"
     
@@ -47,17 +47,16 @@ class MewtTourney(MewtStd):
         bws = []
 
 
-        needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
-        needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)  # sets support fast intersection ops.
+        np_set = self.needed_pieces()  # sets support fast intersection ops.
 
         peer_to_amt_needed_pieces = getNumNeededPiecesPeerHas(np_set, peers, requesting_peers)
 
-        sorted_peers_by_np = sorted(peer_to_amt_needed_pieces.items(), reverse=True, key= lambda x: x[1])
+        # most needed pieces first, ties by peer id so runs are reproducible
+        sorted_peers_by_np = sorted(peer_to_amt_needed_pieces.items(), key= lambda x: (-x[1], x[0]))
 
         unchoked_peers = set()
         for k in range(min(num_unchoke_slots, len(sorted_peers_by_np))):
-            unchoked_peers.add(sorted_peers_by_np[k][0].id)
+            unchoked_peers.add(sorted_peers_by_np[k][0])
             
         # every 3rd round, optimistically unchoke a peer that is not one of the top unchoked peers
         if (round > 0 and round % 3 == 0 and len(requesting_peers) > len(unchoked_peers)):
@@ -90,7 +89,7 @@ def getNumNeededPiecesPeerHas(needed_pieces, peers, requesting_peers):
             for np in needed_pieces:
                 if np in av_pieces:
                     count += 1
-            peer_to_amt_np[peer] = count
+            peer_to_amt_np[peer.id] = count
 
     return peer_to_amt_np
 
@@ -10,8 +10,11 @@ from util import even_split
 from peer import Peer
 
 class MewtTyrant(Peer):
+    # Keep self.needed_pieces() up to date instead of copying self.pieces
+    uses_piece_deltas = True
+
     def post_init(self):
-        print "post_init(): %s here!" % self.id
+        logging.debug("post_init(): %s here!", self.id)
         self.dummy_state = dict()
         self.dummy_state["cake"] = "lie"
         # f_ji: For each peer j, peer i maintains estimates of expected download rate f_ji 
@@ -43,17 +46,17 @@ class MewtTyrant(Peer):
 
         This will be called after update_pieces() with the most recent state.
         """
-        needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
-        needed_pieces = filter(needed, range(len(self.pieces)))
+        needed_pieces = sorted(self.needed_pieces())
         np_set = set(needed_pieces)  # sets support fast intersection ops.
 
         requests = []   
         # Symmetry breaking is good...
         random.shuffle(needed_pieces)
 
-        sorted_np_count_lst = pieceAvailabilityCount2(peers, needed_pieces)
-        if sorted_np_count_lst == None:
-            print "No Requests: None of pieces needed are available"
+        # [(count, [pieces]), ...] rarest first, kept up to date by the sim
+        sorted_np_count_lst = peers.availability.rarest(needed_pieces)
+        if not sorted_np_count_lst:
+            logging.debug("No Requests: None of pieces needed are available")
             return requests
 
         # request all available pieces from all peers!
@@ -148,20 +151,10 @@ class MewtTyrant(Peer):
         else:
             # use the algorithm in the book to determine unchoke slots and capacity. 
 
-            # update which peers unchoked this peer
-
-            seen_unchoked_by_peer = set()
-            # get downloads from previous round
-            downloads = history.downloads[round-1]
-
-            for download in downloads:
-                if download.from_id not in seen_unchoked_by_peer:
-                    self.times_unchoked_by_peer[download.from_id] += 1
-                    seen_unchoked_by_peer.add(download.from_id)
-            # if agent was not unchoked by a peer set it to 0
+            # update which peers unchoked this peer: the number of rounds in a
+            # row they've sent us something, 0 if not last round
             for peer in peers:
-                if peer.id not in seen_unchoked_by_peer:
-                    self.times_unchoked_by_peer[peer.id] = 0
+                self.times_unchoked_by_peer[peer.id] = history.unchoked_streak(peer.id)
 
             updatePeerAfterRound(self, history, g, a, r, peers) 
 
@@ -211,64 +204,5 @@ def updatePeerAfterRound(self, history, g, a, r, peers):
 
 
 def calculateTotalDownloadedFromPeer(self, history, uploader_id):
-    curr_round = history.current_round()
-    previous_round = curr_round - 1
-
-    downloads = []
-    if previous_round > 0:
-        downloads = history.downloads[previous_round]
-    else:
-        downloads = []
-
-    downloads = history.downloads
-
-    total_downloaded = 0
-    for download in downloads:
-        if download.from_id == uploader_id:
-            total_downloaded += download.blocks
-
-    return total_downloaded
-
-
-# return piece availability count for all needed pieces
-def pieceAvailabilityCount(peers, needed_pieces):
-    # create piece: count dictionary
-    piece_count_dict = {}
-
-    check_pieces_available = False;
-    for p in peers:
-        for piece in p.available_pieces:
-            if (piece in needed_pieces):
-                if piece in piece_count_dict:
-                    piece_count_dict[piece] += 1
-                else:
-                    piece_count_dict[piece] = 1
-                    check_pieces_available = True
-
-    if (check_pieces_available == False):
-        print "None of pieces needed are available"
-        return None
-
-    return piece_count_dict
-
-
-def pieceAvailabilityCount2(peers, needed_pieces):
-    # create count: [piece, piece] dictionary
-
-    piece_count_dict = pieceAvailabilityCount(peers, needed_pieces)
-
-    if piece_count_dict == None: 
-        return None
-
-    count_piece_dict = {}
-
-    for piece, count in piece_count_dict.items():
-        if count in count_piece_dict:
-            count_piece_dict[count].append(piece)
-        else:
-            count_piece_dict[count] = [piece]
-
-    sorted_list = sorted(count_piece_dict.items())
-    return sorted_list
-
-
+    # blocks uploader_id sent us in the previous round
+    return history.received_from(uploader_id, 1)
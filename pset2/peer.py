@@ -5,10 +5,17 @@ from messages import Upload, Request
 from util import even_split
 
 class Peer:
+    # Agents that set this get a read-only view of their pieces plus the
+    # pieces that changed each round (update_piece_deltas), instead of a
+    # fresh copy of the whole list (update_pieces).  Either way,
+    # self.pieces[i] is the number of blocks of piece i this peer has.
+    uses_piece_deltas = False
+
     def __init__(self, config, id, init_pieces, up_bandwidth):
         self.conf = config
         self.id = id
         self.pieces = init_pieces[:]
+        self._needed = None
         # bandwidth measured in blocks-per-time-period
         self.up_bw = up_bandwidth
 
@@ -30,6 +37,33 @@ class Peer:
         so it's easy to add any extra processing...
         """
         self.pieces = new_pieces
+        self._needed = None
+
+    def update_piece_deltas(self, pieces, changed):
+        """
+        Called instead of update_pieces if uses_piece_deltas is set.
+        pieces: read-only view of this peer's blocks per piece
+        changed: the pieces that got blocks since the last call
+        """
+        self.pieces = pieces
+        needed = self.needed_pieces()
+        full = self.conf.blocks_per_piece
+        for i in changed:
+            if pieces[i] < full:
+                needed.add(i)
+            else:
+                needed.discard(i)
+
+    def needed_pieces(self):
+        """
+        The set of pieces this peer doesn't have all the blocks of yet.
+        Kept up to date from the deltas, so don't modify it.
+        """
+        if self._needed is None:
+            full = self.conf.blocks_per_piece
+            self._needed = set(i for (i, b) in enumerate(self.pieces)
+                               if b < full)
+        return self._needed
 
     def requests(self, peers, history):
         return []
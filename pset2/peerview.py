@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+from itertools import chain, islice
+
+
+class PeerSnapshot:
+    """
+    The PeerInfo for every peer in one round, shared by all agents.
+
+    peers is a tuple in peer order and by_id maps peer id -> PeerInfo.
+    others(peer_id) gives an agent the list of everyone else without
+    building a new list per agent.  availability, if given, is the sim's
+    pieces.Availability for the round.
+    """
+    def __init__(self, peers, availability=None):
+        self.peers = tuple(peers)
+        self.availability = availability
+        self.by_id = dict((p.id, p) for p in self.peers)
+        self.position = dict((p.id, i) for (i, p) in enumerate(self.peers))
+
+    def others(self, peer_id):
+        return PeerView(self, self.position[peer_id])
+
+
+class PeerView(object):
+    """
+    List-like view of a PeerSnapshot with one peer left out.
+
+    Reading it reads the shared snapshot.  The first time an agent reorders
+    it (shuffle, sort, item assignment...) the view takes a private copy,
+    so agents can still treat it as their own list.
+    """
+    def __init__(self, snapshot, skip):
+        self.snapshot = snapshot
+        self.by_id = snapshot.by_id   # includes the skipped peer
+        self.availability = snapshot.availability
+        self._skip = skip
+        self._order = None   # private list once the agent modifies the view
+
+    def _own(self):
+        if self._order is None:
+            self._order = list(self)
+        return self._order
+
+    def __len__(self):
+        if self._order is not None:
+            return len(self._order)
+        return len(self.snapshot.peers) - 1
+
+    def __iter__(self):
+        if self._order is not None:
+            return iter(self._order)
+        peers = self.snapshot.peers
+        return chain(islice(peers, 0, self._skip),
+                     islice(peers, self._skip + 1, None))
+
+    def __getitem__(self, i):
+        if self._order is not None:
+            return self._order[i]
+        if isinstance(i, slice):
+            return list(self)[i]
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("peer view index out of range")
+        if i >= self._skip:
+            i += 1
+        return self.snapshot.peers[i]
+
+    def __setitem__(self, i, value):
+        self._own()[i] = value
+
+    def __delitem__(self, i):
+        del self._own()[i]
+
+    def __contains__(self, peer):
+        return peer in iter(self)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def index(self, peer):
+        return list(self).index(peer)
+
+    def count(self, peer):
+        return list(self).count(peer)
+
+    def sort(self, *args, **kwargs):
+        self._own().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._own().reverse()
+
+    def append(self, peer):
+        self._own().append(peer)
+
+    def extend(self, peers):
+        self._own().extend(peers)
+
+    def insert(self, i, peer):
+        self._own().insert(i, peer)
+
+    def remove(self, peer):
+        self._own().remove(peer)
+
+    def pop(self, *args):
+        return self._own().pop(*args)
+
+    def __repr__(self):
+        return repr(list(self))
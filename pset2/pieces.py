@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+from array import array
+
+
+class PieceState:
+    """
+    Blocks downloaded so far by every peer, for every piece.
+
+    Stored as a single peers x pieces matrix of ints (one flat array, one row
+    per peer) that is updated in place, so the sim never has to copy the
+    whole state between rounds.
+
+    Also keeps a count of pieces each peer is still missing, and the set of
+    peers that have every piece, so completion checks are O(1).  A piece is
+    full once it has at least blocks_per_piece blocks.
+
+    Blocks are ints, but agents that upload fractional bandwidth do exist,
+    so the matrix is widened to doubles the first time one shows up.  The
+    counts only change when a piece becomes full, so rounding in those
+    fractions can't leave a peer that has every piece not done.
+
+    availability counts how many peers have each piece, kept up to date as
+    pieces complete.
+    """
+    def __init__(self, peer_ids, num_pieces, blocks_per_piece, init_pieces):
+        """
+        peer_ids: list of peer ids, in row order
+        init_pieces: function peer_id -> initial list of blocks per piece
+        """
+        self.peer_ids = peer_ids[:]
+        self.num_pieces = num_pieces
+        self.blocks_per_piece = blocks_per_piece
+
+        # peer_id -> offset of that peer's row in self.blocks
+        self.row = dict((pid, i * num_pieces)
+                        for (i, pid) in enumerate(self.peer_ids))
+        self.blocks = array('i')
+        for pid in self.peer_ids:
+            self.blocks.extend(init_pieces(pid))
+
+        # peer_id -> pieces not full yet
+        self.incomplete = dict(
+            (pid, sum(1 for b in self._row(pid) if b < blocks_per_piece))
+            for pid in self.peer_ids)
+        self.done = set(pid for pid in self.peer_ids
+                        if self.incomplete[pid] == 0)
+        self.availability = Availability(num_pieces, len(self.peer_ids))
+        # peer_id -> pieces that got blocks since take_changes(peer_id)
+        self.changed = dict((pid, set()) for pid in self.peer_ids)
+        for pid in self.peer_ids:
+            for piece_id in self.available_pieces(pid):
+                self.availability._change(piece_id, 1)
+
+    def _row(self, peer_id):
+        start = self.row[peer_id]
+        return self.blocks[start:start + self.num_pieces]
+
+    def pieces(self, peer_id):
+        """
+        Return a fresh list of blocks per piece for peer_id -- the same view
+        agents have always had, and safe for them to modify.
+        """
+        return self._row(peer_id).tolist()
+
+    def view(self, peer_id):
+        """Read-only view of peer_id's blocks per piece, always current"""
+        return PiecesView(self, peer_id)
+
+    def take_changes(self, peer_id):
+        """The pieces peer_id got blocks of since the last call"""
+        changed = self.changed[peer_id]
+        self.changed[peer_id] = set()
+        return changed
+
+    def get(self, peer_id, piece_id):
+        return self.blocks[self.row[peer_id] + piece_id]
+
+    def add(self, peer_id, piece_id, blocks):
+        """
+        Give peer_id blocks more blocks of piece_id.  Returns True if that
+        completed the piece.
+        """
+        i = self.row[peer_id] + piece_id
+        if isinstance(blocks, float) and self.blocks.typecode == 'i':
+            self.blocks = array('d', self.blocks)
+        was_full = self.blocks[i] >= self.blocks_per_piece
+        self.blocks[i] += blocks
+        self.changed[peer_id].add(piece_id)
+        full = self.blocks[i] >= self.blocks_per_piece
+        if full and not was_full:
+            # Blocks only ever go up, so this is the one time it changes
+            self.incomplete[peer_id] -= 1
+            if self.incomplete[peer_id] == 0:
+                self.done.add(peer_id)
+            self.availability._change(piece_id, 1)
+        return full
+
+    def available_pieces(self, peer_id):
+        """
+        Return a list of piece ids that this peer has available.
+        """
+        full = self.blocks_per_piece
+        return [i for (i, b) in enumerate(self._row(peer_id)) if b >= full]
+
+    def completed_pieces(self, peer_id):
+        return self.num_pieces - self.incomplete[peer_id]
+
+    def peer_done(self, peer_id):
+        return peer_id in self.done
+
+    def __repr__(self):
+        return "PieceState(%s)" % ", ".join(
+            "%s=%s" % (pid, self.pieces(pid)) for pid in self.peer_ids)
+
+
+class PiecesView(object):
+    """
+    Read-only, list-like view of one peer's row of a PieceState: view[i] is
+    the number of blocks of piece i the peer has.
+    """
+    __slots__ = ("_state", "_start", "_n")
+
+    def __init__(self, state, peer_id):
+        self._state = state
+        self._start = state.row[peer_id]
+        self._n = state.num_pieces
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if i < 0 or i >= self._n:
+            raise IndexError("piece index out of range")
+        return self._state.blocks[self._start + i]
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        start = self._start
+        return self._state.blocks[start:start + self._n].tolist()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class Availability:
+    """
+    How many peers have each piece: the replication count per piece, plus
+    the pieces bucketed by count, so rarest-first doesn't have to look at
+    every peer.
+
+    The sim updates it as pieces complete; agents see it read-only as
+    peers.availability.
+    """
+    def __init__(self, num_pieces, num_peers):
+        self._counts = array('i', [0] * num_pieces)
+        # count -> set of piece ids with that many copies
+        self._buckets = [set() for i in range(num_peers + 1)]
+        self._buckets[0].update(range(num_pieces))
+
+    def _change(self, piece_id, delta):
+        c = self._counts[piece_id]
+        self._buckets[c].discard(piece_id)
+        self._buckets[c + delta].add(piece_id)
+        self._counts[piece_id] = c + delta
+
+    def count(self, piece_id):
+        """Number of peers that have piece_id"""
+        return self._counts[piece_id]
+
+    def pieces_with(self, count):
+        """List of the pieces exactly count peers have"""
+        return list(self._buckets[count])
+
+    def rarest(self, pieces):
+        """
+        The pieces among `pieces` that someone has, grouped by count, rarest
+        first: [(count, [piece ids]), ...].  The lists are the caller's.
+        """
+        wanted = set(pieces)
+        ans = []
+        for count in range(1, len(self._buckets)):
+            bucket = self._buckets[count]
+            if not bucket:
+                continue
+            if len(bucket) < len(wanted):
+                found = [p for p in bucket if p in wanted]
+            else:
+                found = [p for p in wanted if p in bucket]
+            if found:
+                ans.append((count, found))
+        return ans
+
+    def __repr__(self):
+        return "Availability(%s)" % list(self._counts)
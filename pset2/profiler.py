@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+class Profiler:
+    """
+    Lightweight timers for the sim's round loop.
+
+    Time is recorded against stacks -- tuples like ("requests",) for a phase
+    of the round, or ("requests", "agent", "MewtStd.requests") for agent
+    calls made during it.  A stack's total includes its children.
+    """
+    def __init__(self):
+        self.totals = dict()  # stack -> seconds
+        self.calls = dict()   # stack -> number of times recorded
+        self.rounds = 0
+
+    def add(self, stack, seconds):
+        self.totals[stack] = self.totals.get(stack, 0.0) + seconds
+        self.calls[stack] = self.calls.get(stack, 0) + 1
+
+    def agent_call(self, phase, class_name, method, seconds):
+        self.add((phase, "agent", "%s.%s" % (class_name, method)), seconds)
+
+    def add_run(self, phase_times, rounds):
+        """Add the phase totals for one run of the sim"""
+        for (phase, seconds) in phase_times.items():
+            self.totals[(phase,)] = self.totals.get((phase,), 0.0) + seconds
+        self.rounds += rounds
+
+    def merge(self, other):
+        for (stack, seconds) in other.totals.items():
+            self.totals[stack] = self.totals.get(stack, 0.0) + seconds
+        for (stack, n) in other.calls.items():
+            self.calls[stack] = self.calls.get(stack, 0) + n
+        self.rounds += other.rounds
+        return self
+
+    def _with_parents(self):
+        """Totals, with the intermediate stacks (like "requests;agent")
+        filled in from their children"""
+        totals = dict(self.totals)
+        for stack in self.totals:
+            for i in range(1, len(stack)):
+                parent = stack[:i]
+                if parent not in self.totals:
+                    totals[parent] = totals.get(parent, 0.0) + self.totals[stack]
+        return totals
+
+    def self_times(self):
+        """stack -> time spent in the stack but not in any of its children"""
+        totals = self._with_parents()
+        own = dict(totals)
+        for stack in totals:
+            if len(stack) > 1:
+                own[stack[:-1]] -= totals[stack]
+        return own
+
+    def collapsed(self):
+        """
+        Lines in the collapsed-stack format flamegraph.pl reads:
+        "round;phase;... microseconds"
+        """
+        lines = []
+        for (stack, seconds) in sorted(self.self_times().items()):
+            us = int(round(seconds * 1e6))
+            if us > 0:
+                lines.append("%s %d" % (";".join(("round",) + stack), us))
+        return lines
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for line in self.collapsed():
+                f.write(line + "\n")
+
+    def table(self):
+        """Summary table: one row per stack, parents before children"""
+        totals = self._with_parents()
+        all_phases = sum(t for (s, t) in totals.items() if len(s) == 1)
+        rows = ["%-45s %10s %7s %10s %12s" % (
+            "phase / agent call", "total s", "%", "calls", "ms/call")]
+        for stack in sorted(totals):
+            seconds = totals[stack]
+            n = self.calls.get(stack)
+            name = "  " * (len(stack) - 1) + stack[-1]
+            rows.append("%-45s %10.3f %6.1f%% %10s %12s" % (
+                name, seconds, 100 * seconds / (all_phases or 1),
+                n if n is not None else "",
+                "%.3f" % (1000 * seconds / n) if n else ""))
+        rows.append("%d rounds, %.3f ms/round" % (
+            self.rounds, 1000 * all_phases / (self.rounds or 1)))
+        return "\n".join(rows)
@@ -6,6 +6,9 @@ from util import even_split
 from peer import Peer
 
 class Seed(Peer):
+    # Seeds never look at their pieces, so don't copy them every round
+    uses_piece_deltas = True
+
     def requests(self, peers, history):
         # Seeds don't need anything.
         return []
@@ -8,25 +8,81 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
+import time
+import inspect
+import os
 import random
 import sys
 import logging
-import copy
 import itertools
+import multiprocessing
 import pprint
 from optparse import OptionParser
 
 from messages import Upload, Request, Download, PeerInfo
 from util import *
-from stats import Stats
+from stats import Stats, SummaryStats
 from history import History
+from pieces import PieceState
+from peerview import PeerSnapshot
+from tracefile import TraceWriter
+from profiler import Profiler
+# runcache is shared with the other psets
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "common"))
+from runcache import RunCache
+from calltimes import CallTimes, AgentTimeout, time_limit
+import batchsim
     
 
+# Built-in agents that are known to send well-formed requests and uploads.
+# With --trusted-agents their messages skip validation.
+TRUSTED_AGENTS = set(["Seed", "Dummy"])
+
+# Agents to run when none are given
+DEFAULT_AGENTS = ['Dummy', 'Dummy', 'Seed']
+
+# Config values that affect the results of a run, for the run cache.
+# Everything else (iters, workers, logging...) only changes how runs are
+# done or reported.
+RESULT_SETTINGS = ["agent_class_names", "num_pieces", "blocks_per_piece",
+                   "max_round", "min_up_bw", "max_up_bw"]
+
+# Where run results are cached unless --cache-dir says otherwise: next to
+# this file, not wherever the sim was started from.
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 ".runcache")
+
+# Simulator modules whose source goes into the run cache key, along with
+# the agents' modules.
+SIM_MODULES = [__name__, "messages", "util", "stats", "history", "pieces",
+               "peerview"]
+
+def make_peer_ids(class_names):
+    """Peer ids for the agents: class name plus a count, like "Seed0" """
+    counts = dict()
+    def index(name):
+        if name in counts:
+            a = counts[name]
+            counts[name] += 1
+        else:
+            a = 0
+            counts[name] = 1
+        return a
+
+    return map(lambda n: "%s%d" % (n,index(n)), class_names)
+
 class Sim:
     def __init__(self, config):
         self.config = config
         self.up_bws_state = dict()
+        self.trace = None
+        if config.trace:
+            self.trace = TraceWriter(config.trace)
+        self.profiler = None
+        if config.profile:
+            self.profiler = Profiler()
+        self.call_times = CallTimes()
 
     
     def up_bw(self, peer_id, reinit=False):
@@ -37,9 +93,11 @@ class Sim:
         # Re-initialize up-bws if we are starting a new simulation
         if reinit and peer_id in s:
             del s[peer_id]
+        elif peer_id in s:
+            return s[peer_id]
         
         """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
+        if peer_id.startswith("Seed"): the_up_bw = c.max_up_bw
         else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
         
         return s.setdefault(peer_id, the_up_bw)
@@ -50,95 +108,108 @@ class Sim:
         # Keep track of the current round.  Needs to be in scope for helpers.
         round = 0  
 
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
         def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-            
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
-
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
+            """Raise an IllegalUpload exception if there is a problem.
+            Checks everything in a single pass over uploads."""
+            def bad(msg, u):
+                raise IllegalUpload(msg + " Bad element: %s" % u)
+
+            total_bw = 0
+            for u in uploads:
+                if not isinstance(u, Upload):
+                    bad("List of Uploads contains non-Upload object.", u)
+                if u.to_id == peer.id:
+                    bad("Can't upload to yourself.", u)
+                if u.from_id != peer.id:
+                    bad("Upload.from != peer id.", u)
+                if u.to_id not in self.peers_by_id:
+                    bad("Upload to non-existent peer!", u)
+                if u.bw < 0:
+                    bad("Upload bandwidth must be non-negative!", u)
+                total_bw += u.bw
 
             limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
+            if total_bw > limit:
                 raise IllegalUpload("Can't upload more than limit of %d. %s" % (
                     limit, uploads))
 
             # If we got here, looks ok.
 
         def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
-
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
+            """Raise an IllegalRequest exception if there is a problem.
+            Checks everything in a single pass over requests."""
+            def bad(msg, r):
+                raise IllegalRequest(msg + " Bad element: %s" % r)
+
+            num_pieces = conf.num_pieces
+            blocks_per_piece = conf.blocks_per_piece
+            for r in requests:
+                if not isinstance(r, Request):
+                    bad("List of Requests contains non-Request object.", r)
+                if r.piece_id < 0 or r.piece_id >= num_pieces:
+                    bad("Request asks for non-existent piece!", r)
+                if r.peer_id not in available:
+                    bad("Request mentions non-existent peer!", r)
+                if r.requester_id != peer.id:
+                    bad("Request has wrong peer id!", r)
+                # Must request the _next_ necessary block
+                if (r.start < 0 or r.start >= blocks_per_piece or
+                    r.start > peer_pieces.get(peer.id, r.piece_id)):
+                    bad("Request has bad start block!", r)
+                if r.piece_id not in available[r.peer_id]:
+                    bad("Asking for piece peer does not have!", r)
 
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
-
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-            
             # If we got here, looks ok
 
-        def available_pieces(peer_id, peer_pieces):
+        def validate(phase, check, p, *args):
             """
-            Return a list of piece ids that this peer has available.
+            Run check on p's messages unless p is trusted, adding the time
+            spent to this round's validation counters.
             """
-            return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
-                          range(conf.num_pieces))
-
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
+            counters = self.validation[-1]
+            if p.id in trusted_ids:
+                counters["skipped"] += 1
+                return
+            start = time.time()
+            check(p, *args)
+            seconds = time.time() - start
+            counters["seconds"] += seconds
+            counters["checked"] += 1
+            if self.profiler:
+                self.profiler.add((phase, "validation"), seconds)
+
+        def call_agent(phase, p, method, *args):
+            """
+            Call one of p's methods and time it.  If it takes longer than
+            the call budget, ignore what it returned and use [] instead.
+            """
+            start = time.time()
+            try:
+                with time_limit(conf.call_budget):
+                    ans = getattr(p, method)(*args)
+            except AgentTimeout:
+                ans = []
+            seconds = time.time() - start
+            class_name = p.__class__.__name__
+            self.call_times.add(p.id, class_name, method, seconds)
+            if self.profiler:
+                self.profiler.agent_call(phase, class_name, method, seconds)
+            if conf.call_budget is not None and seconds > conf.call_budget:
+                self.call_times.overrun(round, p.id, method, seconds)
+                logging.warning("%s.%s took %.3f s in round %d, over the "
+                                "%.3f s budget; ignoring it", p.id, method,
+                                seconds, round, conf.call_budget)
+                return []
+            return ans
+
+        def mark_done(peer_id):
+            history.peer_is_done(round, peer_id)
+            newly_done.append(peer_id)
+            logging.info("******** peer is done %s", peer_id)
+
         def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
-                    print "******** peer is done", peer_id
-                else:
-                    result = False
-            return result
+            # Done status is kept up to date by update_peer_pieces.
+            return len(peer_pieces.done) == len(self.peer_ids)
 
         def create_peers():
             """Each agent class must be already loaded, and have a
@@ -149,18 +220,8 @@ class Sim:
                 agent_class = conf.agent_classes[class_name]
                 return agent_class(*params)
 
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
-
             n = len(conf.agent_class_names)
-            ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
+            ids = make_peer_ids(conf.agent_class_names)
 
             is_seed = lambda id: id.startswith("Seed")
 
@@ -170,8 +231,8 @@ class Sim:
                 else:
                     return [0]*conf.num_pieces
                 
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
+            peer_pieces = PieceState(ids, conf.num_pieces,
+                                     conf.blocks_per_piece, get_pieces)
             pieces = [get_pieces(id) for id in ids]
             r = itertools.repeat
             
@@ -185,34 +246,37 @@ class Sim:
             return peers, peer_pieces
 
         def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            pieces = copy.copy(peer_pieces[p.id])
-            # Made copy of pieces and the peer info this peer needs to make it's
-            # decision, so that it can't change the simulation's copies.
-            p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
+            # Made copy of pieces (or, for agents that take deltas, a
+            # read-only view and what changed), and give the peer its own view
+            # of the peer info it needs to make it's decision, so that it
+            # can't change the simulation's copies.
+            if p.uses_piece_deltas:
+                p.update_piece_deltas(peer_pieces.view(p.id),
+                                      peer_pieces.take_changes(p.id))
+            else:
+                p.update_pieces(peer_pieces.pieces(p.id))
+            rs = call_agent("requests", p, "requests",
+                            peer_info.others(p.id), peer_history)
+            validate("requests", check_requests, p, rs, peer_pieces, available)
             return rs
 
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
+        def index_requests(all_requests):
+            """
+            Return dict: peer_id -> list of the Requests sent to that peer,
+            built in one pass over everyone's requests.
+            """
+            inbox = dict((p_id, []) for p_id in self.peer_ids)
+            for rs in all_requests.values():
+                for r in rs:
+                    inbox[r.peer_id].append(r)
+            return inbox
+
+        def get_peer_uploads(inbox, p, peer_info, peer_history):
+            requests = inbox[p.id]
+
+            us = call_agent("uploads", p, "uploads",
+                            requests, peer_info.others(p.id), peer_history)
+            validate("uploads", check_uploads, p, us)
             return us
 
         def upload_rate(uploads, uploader_id, requester_id):
@@ -231,12 +295,11 @@ class Sim:
             pieces the requesters ended up with.
             Make sure requesting the same thing from lots of peers doesn't
             stack.
-            update the sets of available pieces as needed.
+            update the sets of available pieces as needed, and record peers
+            that just finished in the history.
+            peer_pieces is updated in place.
             """
             downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
             for requester_id in requests:
                 # Keep track of how many blocks of each piece this
                 # requester got.  piece -> (blocks, from_who)
@@ -264,47 +327,82 @@ class Sim:
                         bw -= alloced_bw
                         if bw == 0:
                             break
+                rows = []
                 for piece_id in new_blocks_per_piece:
                     (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
+                    if peer_pieces.add(requester_id, piece_id, blocks):
                         available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
+                    rows.append((peer_id, requester_id, piece_id, blocks))
+                downloads[requester_id] = Download.bulk(rows)
+                if (peer_pieces.peer_done(requester_id) and
+                    requester_id not in history.round_done):
+                    mark_done(requester_id)
                 
-            return (new_pp, downloads)
+            return downloads
 
-        def completed_pieces(peer_id, available):
-            return len(available[peer_id])
-        
-        def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
+        def log_peer_info(peer_pieces):
+            if logger.isEnabledFor(logging.DEBUG):
+                for p_id in self.peer_ids:
+                    logging.debug("pieces for %s: %s",
+                                  p_id, peer_pieces.pieces(p_id))
+            if logger.isEnabledFor(logging.INFO):
+                log = ", ".join("%s:%s" % (p_id, peer_pieces.completed_pieces(p_id))
+                                for p_id in self.peer_ids)
+                logging.info("Pieces completed: " + log)
 
 
-        logging.debug("Starting simulation with config: %s" % str(conf))
+        # Only build log messages that will actually be shown.
+        logger = logging.getLogger('')
+        logging.debug("Starting simulation with config: %s", conf)
 
         peers, peer_pieces = create_peers()
         self.peer_ids = [p.id for p in peers]
         self.peers_by_id = dict((p.id, p) for p in peers)
+        # Peers whose requests and uploads we don't bother checking
+        trusted_ids = set()
+        if conf.trusted_agents:
+            trusted_ids = set(p.id for p in peers
+                              if p.__class__.__name__ in TRUSTED_AGENTS)
+        # One dict of validation counters per round
+        self.validation = []
+        # Wall time per round, and total time spent in each phase of a round
+        self.round_times = []
+        self.phase_times = dict()
+        clock = [time.time()]
+
+        def tick(phase):
+            """Charge the time since the last tick to phase"""
+            now = time.time()
+            self.phase_times[phase] = (self.phase_times.get(phase, 0.0) +
+                                       now - clock[0])
+            clock[0] = now
         
         upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
+        history = History(self.peer_ids, upload_rates,
+                          window=conf.history_window)
+        # Peers that finished in the current round, for the trace
+        newly_done = []
+        if self.trace:
+            self.trace.start_run(self.peer_ids, upload_rates)
+        # Seeds are done from the start.
+        for pid in self.peer_ids:
+            if peer_pieces.peer_done(pid):
+                mark_done(pid)
 
         # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
+        available = dict((pid, set(peer_pieces.available_pieces(pid)))
                          for pid in self.peer_ids)
 
         # Begin the event loop
         while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
+            round_start = clock[0] = time.time()
+            logging.info("======= Round %d ========", round)
+            self.validation.append(dict(checked=0, skipped=0, seconds=0.0))
+
+            # One shared snapshot per round; each agent sees everyone else.
+            peer_info = PeerSnapshot((PeerInfo(p.id, available[p.id])
+                                      for p in peers),
+                                     peer_pieces.availability)
             requests = dict()  # peer_id -> list of Requests
             uploads = dict()   # peer_id -> list of Uploads
             h = dict()
@@ -312,20 +410,34 @@ class Sim:
                 h[p.id] = history.peer_history(p.id)
                 requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
                                                    available)
+            inbox = index_requests(requests)
+            tick("requests")
 
             for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
+                uploads[p.id] = get_peer_uploads(inbox, p, peer_info, h[p.id])
+            tick("uploads")
 
-            (peer_pieces, downloads) = update_peer_pieces(
+            downloads = update_peer_pieces(
                 peer_pieces, requests, uploads, available)
+            tick("transfers")
             history.update(downloads, uploads)
-
-            logging.debug(history.pretty_for_round(round))
-
-            log_peer_info(peer_pieces, available)
-           
-            if all_done(peer_pieces):
+            tick("history")
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logging.debug(history.pretty_for_round(round))
+
+            log_peer_info(peer_pieces)
+            logging.debug("Validation: %(checked)d checked, %(skipped)d "
+                          "skipped, %(seconds).6f s", self.validation[-1])
+            if self.trace:
+                self.trace.record_round(round, downloads, newly_done)
+            del newly_done[:]
+            tick("logging")
+
+            done = all_done(peer_pieces)
+            tick("completion")
+            self.round_times.append(clock[0] - round_start)
+            if done:
                 logging.info("All done!")                    
                 break
             round += 1
@@ -333,67 +445,164 @@ class Sim:
                 logging.info("Out of time.  Stopping.")
                 break
 
-        logging.info("Game history:\n%s" % history.pretty())
-
-        logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
-
+        if logger.isEnabledFor(logging.INFO):
+            logging.info("Game history:\n%s" % history.pretty())
+
+            logging.info("======== STATS ========")
+            logging.info("Uploaded blocks:\n%s" %
+                         Stats.uploaded_blocks_str(self.peer_ids, history))
+            logging.info("Completion rounds:\n%s" %
+                         Stats.completion_rounds_str(self.peer_ids, history))
+            logging.info("All done round: %s" %
+                         Stats.all_done_round(self.peer_ids, history))
+            logging.info("Validation time: %.6f s over %d rounds" % (
+                sum(v["seconds"] for v in self.validation),
+                len(self.validation)))
+
+        if self.profiler:
+            self.profiler.add_run(self.phase_times, len(self.round_times))
+        self.call_times.end_run()
         return history
 
     def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(), 
-                        range(self.config.iters))
+        conf = self.config
+        (summary, profiler, call_times) = run_all(conf)
+
         logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = map(
-            lambda h: Stats.uploaded_blocks(self.peer_ids, h),
-            histories)
-        completion_rounds = map(
-            lambda h: Stats.completion_rounds(self.peer_ids, h),
-            histories)
-
-        def extract_by_peer_id(lst, peer_id):
-            """Given a list of dicts, pull out the entry
-            for peer_id from each dict.  Return a list"""
-            return map(lambda d: d[peer_id], lst)
-
-        uploaded_by_id = dict(
-            (p_id, extract_by_peer_id(uploaded_blocks, p_id))
-            for p_id in self.peer_ids)
-
-        completion_by_id = dict(
-            (p_id, extract_by_peer_id(completion_rounds, p_id))
-            for p_id in self.peer_ids)
+        peer_ids = summary.peer_ids
 
         logging.warning("Uploaded blocks: avg (stddev)")
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: mean(uploaded_by_id[id])):
-            us = uploaded_by_id[p_id]
-            logging.warning("%s: %.1f  (%.1f)" % (p_id, mean(us), stddev(us)))
+        for p_id in sorted(peer_ids, key=summary.uploaded_mean):
+            logging.warning("%s: %.1f  (%.1f)" % (
+                p_id, summary.uploaded_mean(p_id),
+                summary.uploaded_stddev(p_id)))
 
         logging.warning("Completion rounds: avg (stddev)")
+        for p_id in sorted(peer_ids, key=summary.completion_mean):
+            logging.warning("%s: %s  (%s)" % (
+                p_id, summary.completion_mean(p_id),
+                summary.completion_stddev(p_id)))
 
-        def optionize(f):
-            def g(lst):
-                if None in lst:
-                    return None
-                else:
-                    return f(lst)
-            return g
+        # Not part of the summary stats, so not shown with --quiet
+        if call_times.times:
+            logging.info("======== AGENT CALL TIMES ========")
+            logging.info(call_times.table())
+
+        if profiler:
+            logging.warning("======== PROFILE ========")
+            logging.warning(profiler.table())
+            profiler.write_collapsed(conf.profile)
+            logging.warning("Collapsed stacks written to %s" % conf.profile)
 
-        opt_mean = optionize(mean)
-        opt_stddev = optionize(stddev)
-        
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: opt_mean(completion_by_id[id])):
-            cs = completion_by_id[p_id]
-            logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
 
+def run_all(conf):
+    """
+    Run all conf.iters iterations, in conf.workers processes, and return
+    the SummaryStats, the Profiler if profiling, and the CallTimes.  The
+    runs are added to the summary in seed order, so the numbers are the
+    same however many workers there are.
+    """
+    seeds = iteration_seeds(conf.seed, conf.iters)
+    workers = max(1, min(conf.workers, conf.iters))
+    summary = SummaryStats(make_peer_ids(conf.agent_class_names))
+    if conf.batch:
+        runs = run_batched(conf, seeds)
+        profiler = None
+        call_times = CallTimes()
+    elif workers == 1:
+        (runs, profiler, call_times) = run_iterations(conf, seeds)
+    else:
+        chunks = [(conf, chunk) for chunk in seed_chunks(seeds, workers)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            partials = pool.map(run_iterations_star, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        runs = [run for (r, p, c) in partials for run in r]
+        call_times = reduce(lambda a, b: a.merge(b),
+                            [c for (r, p, c) in partials])
+        profiler = None
+        if conf.profile:
+            profiler = reduce(lambda a, b: a.merge(b),
+                              [p for (r, p, c) in partials])
+    for result in runs:
+        summary.add_run(*result)
+    return (summary, profiler, call_times)
+
+def iteration_seeds(seed, iters):
+    """
+    One seed per iteration, all drawn from the master seed, so a run gives
+    the same results however the iterations are split up.
+    """
+    rng = random.Random(seed)
+    return [rng.randint(0, sys.maxint) for i in range(iters)]
+
+def seed_chunks(seeds, n):
+    """Split seeds into at most n runs of consecutive seeds, in order"""
+    size = -(-len(seeds) // n)
+    return [seeds[i:i + size] for i in range(0, len(seeds), size)]
+
+def run_iterations(config, seeds):
+    """
+    Run one simulation per seed and return the results in seed order, as
+    (uploaded blocks, completion rounds) dicts, along with the Profiler if
+    profiling, and the CallTimes (for the runs that weren't cached).
+    Lives at module level so worker processes can run it.
+    """
+    sim = Sim(config)
+    cache = open_cache(config)
+    runs = []
+    for seed in seeds:
+        key = None
+        result = None
+        if cache:
+            settings = dict((k, getattr(config, k)) for k in RESULT_SETTINGS)
+            key = cache.key(settings, seed)
+            result = cache.get(key)
+        if result is None:
+            random.seed(seed)
+            history = sim.run_sim_once()
+            result = (Stats.uploaded_blocks(sim.peer_ids, history),
+                      Stats.completion_rounds(sim.peer_ids, history))
+            history.close()
+            if cache:
+                cache.put(key, result)
+        runs.append(result)
+    if sim.trace:
+        sim.trace.close()
+    return (runs, sim.profiler, sim.call_times)
+
+def run_batched(config, seeds):
+    """
+    Like run_iterations, but with the batched NumPy engine (Seed and Dummy
+    swarms only), batchsim.BATCH_SIZE iterations at a time.
+    """
+    peer_ids = make_peer_ids(config.agent_class_names)
+    runs = []
+    for start in range(0, len(seeds), batchsim.BATCH_SIZE):
+        chunk = seeds[start:start + batchsim.BATCH_SIZE]
+        runs.extend(batchsim.run_batch(config, peer_ids, len(chunk),
+                                       chunk[0]))
+    return runs
+
+def open_cache(config):
+    """
+    The RunCache to use, or None.  Runs are only cached when their seeds are
+    reproducible, and not when tracing or profiling -- those need the runs
+    to actually happen -- or when there's a call budget, which makes the
+    results depend on timing.
+    """
+    if (config.cache_dir is None or config.seed is None or
+        config.trace or config.profile or config.call_budget is not None):
+        return None
+    modules = list(SIM_MODULES)
+    for agent_class in config.agent_classes.values():
+        modules.extend(c.__module__ for c in inspect.getmro(agent_class))
+    return RunCache(config.cache_dir, config.cache_size << 20, modules)
+
+def run_iterations_star(args):
+    return run_iterations(*args)
 
 
 def configure_logging(loglevel):
@@ -467,6 +676,63 @@ def main(args):
                       dest="iters", default=1, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--trusted-agents",
+                      dest="trusted_agents", default=False,
+                      action="store_true",
+                      help="Skip validating messages from built-in agents")
+
+    parser.add_option("--quiet",
+                      dest="quiet", default=False, action="store_true",
+                      help="Only print the summary stats (same as "
+                      "--loglevel warning)")
+
+    parser.add_option("--trace",
+                      dest="trace", default=None,
+                      help="Write a structured trace of every round to "
+                      "this file (JSON lines)")
+
+    parser.add_option("--profile",
+                      dest="profile", default=None,
+                      help="Time each round phase and agent call; print a "
+                      "summary and write collapsed stacks (for flame graphs) "
+                      "to this file")
+
+    parser.add_option("--history-window",
+                      dest="history_window", default=None, type="int",
+                      help="Keep only this many rounds of history in memory "
+                      "and spill older rounds to a temporary file")
+
+    parser.add_option("--call-budget",
+                      dest="call_budget", default=None, type="float",
+                      help="Max seconds an agent's requests() or uploads() "
+                      "call may take; slower calls are ignored")
+
+    parser.add_option("--batch",
+                      dest="batch", default=False, action="store_true",
+                      help="Run the iterations with the batched NumPy "
+                      "engine (only for Seed and Dummy agents)")
+
+    parser.add_option("--no-cache",
+                      dest="no_cache", default=False, action="store_true",
+                      help="Don't read or write cached run results")
+
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=DEFAULT_CACHE_DIR,
+                      help="Where to cache run results (only used with "
+                      "--seed)")
+
+    parser.add_option("--cache-size",
+                      dest="cache_size", default=64, type="int",
+                      help="Max size of the run cache, in MB")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to spread iterations across")
+
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Master seed for random numbers")
+
 
     (options, args) = parser.parse_args()
 
@@ -474,14 +740,28 @@ def main(args):
     # "Peer Seed[,4]"
 
     if len(args) == 0:
-        # default
-        agents_to_run = ['Dummy', 'Dummy', 'Seed']
+        agents_to_run = DEFAULT_AGENTS[:]
     else:
         try:
             agents_to_run = parse_agents(args)
         except ValueError, e:
             usage(e)
     
+    if options.quiet:
+        options.loglevel = "warning"
+    if options.trace and options.workers > 1:
+        usage("--trace can't be combined with --workers")
+    if options.batch:
+        if not batchsim.available():
+            usage("--batch needs NumPy")
+        if not batchsim.supports(agents_to_run):
+            usage("--batch only runs %s agents" %
+                  " and ".join(sorted(batchsim.SUPPORTED)))
+        if options.trace or options.profile:
+            usage("--batch can't be combined with --trace or --profile")
+    if options.history_window is not None and options.history_window < 1:
+        usage("--history-window must be at least 1")
+
     configure_logging(options.loglevel)
     config = Params()
 
@@ -495,13 +775,21 @@ def main(args):
     config.add("min_up_bw", options.min_up_bw)
     config.add("max_up_bw", options.max_up_bw)
     config.add("iters", options.iters)
+    config.add("workers", options.workers)
+    config.add("trusted_agents", options.trusted_agents)
+    config.add("trace", options.trace)
+    config.add("profile", options.profile)
+    config.add("history_window", options.history_window)
+    config.add("call_budget", options.call_budget)
+    config.add("batch", options.batch)
+    config.add("cache_dir", None if options.no_cache else options.cache_dir)
+    config.add("cache_size", options.cache_size)
+    config.add("seed", options.seed)
     
     sim = Sim(config)
     sim.run_sim()
 
 if __name__ == "__main__":
-
-    # The next two lines are for profiling...
-    import cProfile
-    cProfile.run('main(sys.argv)', 'out.prof')
-#    main(sys.argv)
+    # Use --profile for timings.  For a full cProfile run, use
+    #   python -m cProfile -o out.prof sim.py ...
+    main(sys.argv)
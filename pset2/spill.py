@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+import mmap
+import struct
+import tempfile
+from array import array
+
+# Each array is stored as a header (typecode, item count) plus its bytes.
+HEADER = struct.Struct("<cI")
+
+
+class SpillLog:
+    """
+    Append-only binary log of groups of arrays, read back through mmap.
+
+    append() writes a list of arrays and returns a (offset, count) handle;
+    read(handle) returns copies of the same arrays.  The file is anonymous
+    and goes away when the log is closed or garbage collected.
+    """
+    def __init__(self, dir=None):
+        self.f = tempfile.TemporaryFile(prefix="history-", dir=dir)
+        self.size = 0
+        self.map = None
+
+    def append(self, arrays):
+        offset = self.size
+        self.f.seek(offset)
+        for a in arrays:
+            self.f.write(HEADER.pack(a.typecode, len(a)))
+            a.tofile(self.f)
+        self.f.flush()
+        self.size = self.f.tell()
+        return (offset, len(arrays))
+
+    def read(self, handle):
+        (offset, count) = handle
+        if self.map is None or len(self.map) < self.size:
+            # The log has grown since we last mapped it.
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.f.fileno(), self.size,
+                                 access=mmap.ACCESS_READ)
+        arrays = []
+        for i in range(count):
+            (typecode, n) = HEADER.unpack_from(self.map, offset)
+            offset += HEADER.size
+            a = array(typecode)
+            nbytes = n * a.itemsize
+            a.fromstring(self.map[offset:offset + nbytes])
+            offset += nbytes
+            arrays.append(a)
+        return arrays
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.f.close()
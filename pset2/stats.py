@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import math
+
 class Stats:
     @staticmethod
     def uploaded_blocks(peer_ids, history):
@@ -10,13 +12,8 @@ class Stats:
         Returns:
         dict: peer_id -> total upload blocks used
         """
-        uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
-        return uploaded
+        uploaded = history.uploaded_blocks()
+        return dict((peer_id, uploaded[peer_id]) for peer_id in peer_ids)
 
     @staticmethod
     def uploaded_blocks_str(peer_ids, history):
@@ -54,3 +51,92 @@ class Stats:
             return None
         return max(d.values())
     
+
+class SummaryStats:
+    """
+    Per-peer means and standard deviations of uploaded blocks and completion
+    rounds over a batch of iterations, kept with Welford's update.  Batches
+    run separately (e.g. in different processes) can be combined with
+    merge(), which gives the same summary as one big batch up to rounding;
+    add the runs in the same order to get exactly the same numbers.
+    """
+    def __init__(self, peer_ids):
+        self.peer_ids = peer_ids[:]
+        self.n = 0
+        # peer_id -> [count, mean, sum of squared differences from the mean]
+        self.uploaded = dict((id, [0, 0.0, 0.0]) for id in peer_ids)
+        self.completion = dict((id, [0, 0.0, 0.0]) for id in peer_ids)
+        # peer_id -> number of iterations where the peer never finished
+        self.incomplete = dict((id, 0) for id in peer_ids)
+
+    def add(self, history):
+        """Add the results of one iteration"""
+        self.add_run(Stats.uploaded_blocks(self.peer_ids, history),
+                     Stats.completion_rounds(self.peer_ids, history))
+
+    def add_run(self, uploaded, completion):
+        """
+        Add one iteration's results: dicts peer_id -> uploaded blocks and
+        peer_id -> completion round (or None)
+        """
+        self.n += 1
+        for id in self.peer_ids:
+            SummaryStats._accumulate(self.uploaded[id], uploaded[id])
+            if completion[id] is None:
+                self.incomplete[id] += 1
+            else:
+                SummaryStats._accumulate(self.completion[id], completion[id])
+
+    def merge(self, other):
+        self.n += other.n
+        for id in self.peer_ids:
+            SummaryStats._combine(self.uploaded[id], other.uploaded[id])
+            SummaryStats._combine(self.completion[id], other.completion[id])
+            self.incomplete[id] += other.incomplete[id]
+        return self
+
+    @staticmethod
+    def _accumulate(moments, x):
+        """Welford's update of [count, mean, sum of squares] with x"""
+        moments[0] += 1
+        delta = x - moments[1]
+        moments[1] += delta / float(moments[0])
+        moments[2] += delta * (x - moments[1])
+
+    @staticmethod
+    def _combine(moments, other):
+        """Chan et al.'s update: moments of both batches together"""
+        n = moments[0] + other[0]
+        if other[0] == 0:
+            return
+        delta = other[1] - moments[1]
+        moments[1] += delta * other[0] / float(n)
+        moments[2] += other[2] + delta * delta * moments[0] * other[0] / float(n)
+        moments[0] = n
+
+    @staticmethod
+    def _mean(moments):
+        return moments[1]
+
+    @staticmethod
+    def _stddev(moments):
+        if moments[0] == 0:
+            return 0
+        return math.sqrt(moments[2] / moments[0])
+
+    def uploaded_mean(self, id):
+        return SummaryStats._mean(self.uploaded[id])
+
+    def uploaded_stddev(self, id):
+        return SummaryStats._stddev(self.uploaded[id])
+
+    def completion_mean(self, id):
+        """None if the peer didn't finish in some iteration"""
+        if self.incomplete[id] > 0:
+            return None
+        return SummaryStats._mean(self.completion[id])
+
+    def completion_stddev(self, id):
+        if self.incomplete[id] > 0:
+            return None
+        return SummaryStats._stddev(self.completion[id])
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+"""
+Parameter sweeps for sim.py.
+
+Runs every combination of the given settings and agent mixes in a pool of
+worker processes, with each configuration's iterations split among them,
+and appends the summary stats to a results file (CSV, or JSON lines if it
+ends in .jsonl) as each configuration finishes.
+Rerunning the same command skips configurations already in the file, so
+an interrupted sweep picks up where it left off.
+
+  sweep.py --out results.csv --grid num_pieces=16,32 \\
+      --grid blocks_per_piece=4,8 --agents "Seed Dummy,9" \\
+      --agents "Seed MewtStd,9" --iters 10 --workers 4
+
+  sweep.py --out results.jsonl --configs configs.json
+
+configs.json is a list of objects with any of the SETTINGS keys below, and
+"agents" (e.g. "Seed,2 MewtStd,8").
+"""
+
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from optparse import OptionParser
+
+from util import Params, load_modules
+from sim import run_iterations, iteration_seeds, seed_chunks, parse_agents
+from sim import make_peer_ids, DEFAULT_AGENTS, DEFAULT_CACHE_DIR
+from stats import SummaryStats
+
+# Settings that can be swept, with sim.py's defaults
+SETTINGS = [("num_pieces", 3), ("blocks_per_piece", 4), ("max_round", 5),
+            ("min_up_bw", 4), ("max_up_bw", 10), ("iters", 1), ("seed", 0)]
+
+FIELDS = (["config_id", "agents"] + [k for (k, v) in SETTINGS] +
+          ["peer", "uploaded_mean", "uploaded_stddev", "completion_mean",
+           "completion_stddev"])
+
+
+def config_id(settings):
+    """Stable id for a configuration, used to resume"""
+    blob = json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def expand(grid, agent_mixes, base):
+    """
+    Every combination of the grid values and agent mixes, as settings dicts.
+    grid: [(setting, [values])]
+    """
+    names = [k for (k, vs) in grid]
+    ans = []
+    for mix in agent_mixes:
+        for values in itertools.product(*[vs for (k, vs) in grid]):
+            settings = dict(base)
+            settings.update(zip(names, values))
+            settings["agents"] = mix
+            ans.append(settings)
+    return ans
+
+
+def make_config(settings, cache_dir, cache_size):
+    """The sim config for a settings dict"""
+    names = parse_agents(settings["agents"].split())
+    config = Params()
+    config.add("agent_class_names", names)
+    config.add("agent_classes", load_modules(names))
+    for (k, default) in SETTINGS:
+        config.add(k, settings[k])
+    config.add("workers", 1)
+    config.add("trusted_agents", False)
+    config.add("trace", None)
+    config.add("profile", None)
+    config.add("history_window", None)
+    config.add("call_budget", None)
+    config.add("cache_dir", cache_dir)
+    config.add("cache_size", cache_size)
+    return config
+
+
+def chunk_tasks(index, settings, workers, cache_dir, cache_size):
+    """
+    Split one configuration's iterations into up to `workers` tasks, so a
+    sweep of a few configurations still keeps every worker busy.  Each
+    task is (index, chunk number, settings, seeds, cache_dir, cache_size).
+    """
+    seeds = iteration_seeds(settings["seed"], settings["iters"])
+    return [(index, j, settings, chunk, cache_dir, cache_size)
+            for (j, chunk) in enumerate(seed_chunks(seeds, max(1, workers)))]
+
+
+def run_chunk(args):
+    """
+    Run one chunk of a configuration's iterations, and return (index,
+    chunk number, results of the runs in seed order).  Lives at module
+    level so worker processes can run it.
+    """
+    (index, j, settings, seeds, cache_dir, cache_size) = args
+    config = make_config(settings, cache_dir, cache_size)
+    (runs, profiler, call_times) = run_iterations(config, seeds)
+    return (index, j, runs)
+
+
+def summary_rows(settings, summary):
+    """A configuration's result rows, one per peer"""
+    rows = []
+    for p_id in summary.peer_ids:
+        row = dict(settings)
+        row.update(config_id=config_id(settings),
+                   peer=p_id,
+                   uploaded_mean=summary.uploaded_mean(p_id),
+                   uploaded_stddev=summary.uploaded_stddev(p_id),
+                   completion_mean=summary.completion_mean(p_id),
+                   completion_stddev=summary.completion_stddev(p_id))
+        rows.append(row)
+    return rows
+
+
+class ResultsFile:
+    """
+    Append-only results, as CSV or (for *.jsonl) JSON lines.  Each
+    configuration's rows are written and flushed together.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.jsonl = path.endswith(".jsonl")
+        self.done = self._truncate_and_read()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, "ab")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.f, FIELDS)
+            if new:
+                self.writer.writerow(dict(zip(FIELDS, FIELDS)))
+
+    def _truncate_and_read(self):
+        """
+        Drop a partly written last line, left by a sweep that was killed,
+        and return the set of config ids already in the file.
+        """
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind("\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        lines = data[:end].splitlines()
+        if self.jsonl:
+            rows = [json.loads(line) for line in lines if line]
+        else:
+            rows = csv.DictReader(lines)
+        return set(row["config_id"] for row in rows)
+
+    def write(self, rows):
+        for row in rows:
+            if self.jsonl:
+                self.f.write(json.dumps(row, sort_keys=True) + "\n")
+            else:
+                self.writer.writerow(row)
+        self.f.flush()
+        self.done.update(row["config_id"] for row in rows)
+
+    def close(self):
+        self.f.close()
+
+
+def parse_grid(specs):
+    """["num_pieces=16,32", ...] -> [("num_pieces", [16, 32]), ...]"""
+    known = dict(SETTINGS)
+    grid = []
+    for spec in specs:
+        (k, vs) = spec.split("=", 1)
+        if k not in known:
+            raise ValueError("Unknown setting %s" % k)
+        grid.append((k, [int(v) for v in vs.split(",")]))
+    return grid
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--out", dest="out", default="sweep.csv",
+                      help="Results file to append to (.csv or .jsonl)")
+    parser.add_option("--grid", dest="grid", default=[], action="append",
+                      help="Setting and values to sweep, like "
+                      "num_pieces=16,32.  Repeat for more settings")
+    parser.add_option("--agents", dest="agents", default=[], action="append",
+                      help="Agent mix, like \"Seed,2 Dummy,8\".  Repeat to "
+                      "sweep several mixes.  Default: sim.py's agents")
+    parser.add_option("--configs", dest="configs", default=None,
+                      help="JSON file with a list of configurations, "
+                      "instead of --grid and --agents")
+    parser.add_option("--workers", dest="workers",
+                      default=multiprocessing.cpu_count(), type="int",
+                      help="Number of worker processes")
+    parser.add_option("--no-cache", dest="no_cache", default=False,
+                      action="store_true",
+                      help="Don't read or write cached run results")
+    parser.add_option("--cache-dir", dest="cache_dir",
+                      default=DEFAULT_CACHE_DIR,
+                      help="Where to cache run results")
+    parser.add_option("--cache-size", dest="cache_size", default=64,
+                      type="int", help="Max size of the run cache, in MB")
+    for (k, default) in SETTINGS:
+        parser.add_option("--" + k.replace("_", "-"), dest=k,
+                          default=default, type="int",
+                          help="Value of %s when not swept (default %d)" %
+                          (k, default))
+    (options, args) = parser.parse_args(args[1:])
+
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger('').setLevel(logging.WARNING)
+
+    base = dict((k, getattr(options, k)) for (k, default) in SETTINGS)
+    try:
+        if options.configs:
+            configs = []
+            for c in json.load(open(options.configs)):
+                unknown = set(c) - set(base) - set(["agents"])
+                if unknown:
+                    raise ValueError("Unknown settings %s" %
+                                     ", ".join(sorted(unknown)))
+                settings = dict(base)
+                settings.update(c)
+                configs.append(settings)
+        else:
+            configs = expand(parse_grid(options.grid),
+                             options.agents or [" ".join(DEFAULT_AGENTS)],
+                             base)
+    except ValueError, e:
+        parser.error(str(e))
+
+    results = ResultsFile(options.out)
+    todo = [c for c in configs if config_id(c) not in results.done]
+    logging.warning("%d configurations, %d already done" % (
+        len(configs), len(configs) - len(todo)))
+
+    cache_dir = None if options.no_cache else options.cache_dir
+    workers = max(1, options.workers)
+    tasks = []
+    parts = dict()   # index into todo -> runs per chunk, as they come
+    for (index, c) in enumerate(todo):
+        chunks = chunk_tasks(index, c, workers, cache_dir, options.cache_size)
+        parts[index] = [None] * len(chunks)
+        tasks.extend(chunks)
+
+    pool = multiprocessing.Pool(workers)
+    finished = 0
+    try:
+        for (index, j, runs) in pool.imap_unordered(run_chunk, tasks):
+            parts[index][j] = runs
+            if None in parts[index]:
+                continue
+            # Added in seed order, so the stats don't depend on timing or
+            # the number of workers, and match sim.py's
+            settings = todo[index]
+            summary = SummaryStats(make_peer_ids(
+                parse_agents(settings["agents"].split())))
+            for chunk in parts.pop(index):
+                for result in chunk:
+                    summary.add_run(*result)
+            rows = summary_rows(settings, summary)
+            results.write(rows)
+            finished += 1
+            logging.warning("[%d/%d] %s" % (finished, len(todo),
+                                            rows[0]["config_id"]))
+    finally:
+        pool.terminate()
+        pool.join()
+        results.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
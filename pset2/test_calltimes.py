@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import random
+
+from calltimes import CallTimes, TimeHistogram
+
+def test_percentiles_close_to_exact():
+    rng = random.Random(1)
+    times = [rng.lognormvariate(-8, 1.5) for i in range(5000)]
+    hist = TimeHistogram()
+    for t in times:
+        hist.add(t)
+    ordered = sorted(times)
+    step = 2 ** (1.0 / TimeHistogram.BUCKETS_PER_DOUBLING)
+    for p in CallTimes.PERCENTILES:
+        exact = ordered[-(-p * len(ordered) // 100) - 1]
+        assert exact <= hist.percentile(p) <= exact * step
+    assert hist.count == len(times)
+    assert hist.max == max(times)
+    assert hist.percentile(100) == max(times)
+
+def test_merge_same_as_one_histogram():
+    ct = [CallTimes(), CallTimes()]
+    both = CallTimes()
+    for i in range(200):
+        seconds = 1e-5 * (i + 1)
+        ct[i % 2].add("Dummy0", "Dummy", "uploads", seconds)
+        both.add("Dummy0", "Dummy", "uploads", seconds)
+    merged = ct[0].merge(ct[1])
+    key = ("Dummy0", "uploads")
+    assert list(merged.times[key].counts) == list(both.times[key].counts)
+    assert merged.times[key].count == 200
+    assert merged.times[key].max == both.times[key].max
+    assert merged.table() == both.table()
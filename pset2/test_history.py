@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+from history import History, Received
+from messages import Download
+
+def make_history(num_rounds):
+    """Round r: "b" sends "a" r blocks, and "c" sends 1 in even rounds"""
+    h = History(["a", "b", "c"], dict(a=4, b=4, c=4))
+    for r in range(num_rounds):
+        dls = [Download("b", "a", 0, r)]
+        if r % 2 == 0:
+            dls.append(Download("c", "a", 1, 1))
+        h.update(dict(a=dls, b=[], c=[]), dict(a=[], b=[], c=[]))
+    return h
+
+def scan(h, n):
+    """received_in_last(n), the slow way"""
+    ans = dict()
+    rounds = h.downloads["a"]
+    for rd in range(max(0, len(rounds) - n), len(rounds)):
+        for d in rounds[rd]:
+            ans[d.from_id] = ans.get(d.from_id, 0) + d.blocks
+    return dict((pid, b) for (pid, b) in ans.items() if b != 0)
+
+def test_received_any_window():
+    num_rounds = 3 * Received.INITIAL_WINDOW
+    h = make_history(num_rounds)
+    a = h.peer_history("a")
+    for n in [0, 1, 2, 5, Received.INITIAL_WINDOW, 15, 25, num_rounds,
+              num_rounds + 5]:
+        assert a.received_in_last(n) == scan(h, n)
+        assert a.received_from("b", n) == scan(h, n).get("b", 0)
+        assert a.received_from("c", n) == scan(h, n).get("c", 0)
+    assert a.received_in_last() == scan(h, num_rounds)
+
+def test_received_keeps_longest_window():
+    h = make_history(30)
+    a = h.peer_history("a")
+    assert a.received_from("b", 20) == sum(range(10, 30))
+    # From now on enough rounds are kept to answer from the totals
+    for r in range(10):
+        h.update(dict(a=[Download("b", "a", 0, 100)], b=[], c=[]),
+                 dict(a=[], b=[], c=[]))
+        assert a.received_from("b", 20) == sum(range(11 + r, 30)) + 100 * (r + 1)
+    assert h.received["a"].received_in_last(20) is not None
+    assert a.unchoked_streak("b") == 40
+    assert a.unchoked_streak("c") == 0
+
+def test_received_window_drops_old_rounds():
+    r = Received()
+    for i in range(Received.INITIAL_WINDOW):
+        r.add_round([Download("b", "a", 0, 0.1), Download("c", "a", 0, 1)])
+    for i in range(Received.INITIAL_WINDOW):
+        r.add_round([Download("c", "a", 0, 1)])
+    # "b" hasn't sent anything in the rounds kept: gone, not 1e-16
+    assert r.received_in_last(Received.INITIAL_WINDOW) == dict(
+        c=Received.INITIAL_WINDOW)
+    assert r.received_from("b", Received.INITIAL_WINDOW) == 0
+    assert r.received_in_last(3) == dict(c=3)
+    assert len(r.deltas) == Received.INITIAL_WINDOW
+    assert r.received_in_last(Received.INITIAL_WINDOW + 1) is None
+
+def test_column_slices_match_messages():
+    for window in [None, 2]:
+        h = make_history(6)
+        if window is not None:
+            h = History(["a", "b", "c"], dict(a=4, b=4, c=4), window=window)
+            for r in range(6):
+                h.update(dict(a=[Download("b", "a", 0, r)],
+                              b=[Download("c", "b", r % 2, 0.5)], c=[]),
+                         dict(a=[], b=[], c=[]))
+        for pid in ["a", "b", "c"]:
+            a = h.peer_history(pid)
+            for rd in range(6):
+                dls = a.downloads[rd]
+                (from_ids, pieces, blocks) = a.download_columns(rd)
+                assert list(from_ids) == [d.from_id for d in dls]
+                assert list(pieces) == [d.piece for d in dls]
+                assert list(blocks) == [d.blocks for d in dls]
+                sent = [d for q in ["a", "b", "c"]
+                        for d in h.downloads[q][rd] if d.from_id == pid]
+                assert map(repr, h.downloads_from(pid, rd)) == map(repr, sent)
+        h.close()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+from pieces import PieceState
+
+def empty_state(peer_ids, num_pieces, blocks_per_piece):
+    return PieceState(peer_ids, num_pieces, blocks_per_piece,
+                      lambda pid: [0] * num_pieces)
+
+def test_fractional_uploads_finish_peer():
+    # Adds up to 4.000...04 in floats, more than enough blocks, but
+    # counting the blocks still needed left 4.4e-16 of them
+    state = empty_state(["a"], 2, 4)
+    for piece_id in range(2):
+        for blocks in [0.1, 0.2, 3.7]:
+            state.add("a", piece_id, blocks)
+    assert state.available_pieces("a") == [0, 1]
+    assert state.completed_pieces("a") == 2
+    assert state.peer_done("a")
+
+def test_not_done_until_every_piece_full():
+    state = empty_state(["a"], 2, 4)
+    assert not state.add("a", 0, 1.5)
+    assert state.add("a", 0, 2.5)
+    assert not state.peer_done("a")
+    state.add("a", 1, 4)
+    assert state.peer_done("a")
+
+def check_availability(state):
+    """The counts and buckets agree with every peer's available pieces"""
+    avail = state.availability
+    for piece_id in range(state.num_pieces):
+        having = [pid for pid in state.peer_ids
+                  if piece_id in state.available_pieces(pid)]
+        assert avail.count(piece_id) == len(having)
+        assert piece_id in avail.pieces_with(len(having))
+
+def test_availability_after_overshoot():
+    state = empty_state(["a", "b", "c"], 3, 4)
+    # More blocks than the piece needs, then more on top of a full piece
+    state.add("a", 0, 3)
+    state.add("a", 0, 3)
+    state.add("a", 0, 2.5)
+    state.add("b", 0, 4)
+    state.add("b", 1, 0.1)
+    state.add("b", 1, 0.2)
+    state.add("b", 1, 3.7)
+    state.add("c", 2, 1)
+    check_availability(state)
+    assert state.availability.count(0) == 2
+    assert state.availability.count(1) == 1
+    assert state.availability.count(2) == 0
+    assert state.availability.rarest([0, 1, 2]) == [(1, [1]), (2, [0])]
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import math
+import random
+
+import pytest
+
+import batchsim
+from util import Params, load_modules
+from sim import run_all, parse_agents
+from stats import SummaryStats
+
+def make_config(agents, **settings):
+    """A config like sim.py's main() makes, with its defaults"""
+    config = Params()
+    names = parse_agents(agents.split())
+    config.add("agent_class_names", names)
+    config.add("agent_classes", load_modules(names))
+    defaults = dict(num_pieces=3, blocks_per_piece=4, max_round=5,
+                    min_up_bw=4, max_up_bw=10, iters=1, workers=1,
+                    trusted_agents=False, trace=None, profile=None,
+                    history_window=None, call_budget=None, batch=False,
+                    cache_dir=None, cache_size=64, seed=None)
+    defaults.update(settings)
+    for (k, v) in defaults.items():
+        config.add(k, v)
+    return config
+
+def summary_numbers(summary):
+    return [(p_id, summary.uploaded_mean(p_id),
+             summary.uploaded_stddev(p_id),
+             summary.completion_mean(p_id),
+             summary.completion_stddev(p_id))
+            for p_id in summary.peer_ids]
+
+def test_workers_same_as_serial():
+    # MewtTyrant uploads fractional blocks, so the order the runs are added
+    # in changes the float sums
+    agents = "MewtTyrant,3 MewtTourney,2 Dummy,2 Seed"
+    results = []
+    for workers in [1, 3]:
+        config = make_config(agents, num_pieces=8, max_round=20, iters=12,
+                             seed=7, workers=workers)
+        (summary, profiler, call_times) = run_all(config)
+        assert summary.n == 12
+        results.append(summary_numbers(summary))
+    assert results[0] == results[1]
+
+def test_summary_stats_precise():
+    # Large values with a small spread: sums of squares lose all of it
+    rng = random.Random(3)
+    values = [1e9 + rng.random() for i in range(1000)]
+    summary = SummaryStats(["a"])
+    for x in values:
+        summary.add_run(dict(a=x), dict(a=None))
+    mean = sum(v - 1e9 for v in values) / len(values) + 1e9
+    var = sum((v - mean) ** 2 for v in values) / len(values)
+    assert abs(summary.uploaded_mean("a") - mean) < 1e-6
+    assert abs(summary.uploaded_stddev("a") - var ** 0.5) < 1e-6
+    assert summary.completion_mean("a") is None
+
+def test_merge_same_as_one_batch():
+    rng = random.Random(4)
+    runs = [(dict(a=rng.uniform(0, 100)), dict(a=rng.randint(1, 20)))
+            for i in range(50)]
+    both = SummaryStats(["a"])
+    parts = [SummaryStats(["a"]), SummaryStats(["a"]), SummaryStats(["a"])]
+    for (i, run) in enumerate(runs):
+        both.add_run(*run)
+        # The last part stays empty
+        parts[i * 2 // len(runs)].add_run(*run)
+    merged = reduce(lambda a, b: a.merge(b), parts)
+    assert merged.n == both.n
+    for (x, y) in zip(summary_numbers(merged)[0], summary_numbers(both)[0]):
+        if isinstance(x, float):
+            assert abs(x - y) < 1e-9
+        else:
+            assert x == y
+
+def test_cached_same_as_fresh(tmpdir):
+    agents = "MewtTourney,3 MewtTyrant,2 MewtStd,2 MewtPropShare Seed,2"
+    settings = dict(num_pieces=16, max_round=40, iters=6, seed=5)
+    (fresh, p, c) = run_all(make_config(agents, **settings))
+    cached = make_config(agents, cache_dir=str(tmpdir), **settings)
+    (first, p, c) = run_all(cached)
+    assert c.times
+    (second, p, c) = run_all(cached)
+    # Every run came from the cache, so none were timed
+    assert not c.times
+    assert summary_numbers(first) == summary_numbers(fresh)
+    assert summary_numbers(second) == summary_numbers(fresh)
+
+@pytest.mark.skipif(not batchsim.available(), reason="needs NumPy")
+def test_batch_agrees_with_sim():
+    # Different random streams, so the means agree only up to sampling
+    # error: allow 4 standard errors of the difference
+    n = 400
+    (serial, p, c) = run_all(make_config("Dummy,5 Seed,2", iters=n, seed=1))
+    (batch, p, c) = run_all(make_config("Dummy,5 Seed,2", iters=n, seed=1,
+                                        batch=True))
+    for p_id in serial.peer_ids:
+        for (mean, stddev) in [("uploaded_mean", "uploaded_stddev"),
+                               ("completion_mean", "completion_stddev")]:
+            a = getattr(serial, mean)(p_id)
+            b = getattr(batch, mean)(p_id)
+            se = math.sqrt((getattr(serial, stddev)(p_id) ** 2 +
+                            getattr(batch, stddev)(p_id) ** 2) / n)
+            assert abs(a - b) <= 4 * se + 1e-9, (p_id, mean, a, b)
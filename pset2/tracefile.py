@@ -0,0 +1,40 @@
+#!/usr/bin/python
+
+import json
+
+
+class TraceWriter:
+    """
+    Buffered, structured trace of simulation runs: one JSON object per line.
+
+    Each run starts with a line
+      {"run": i, "peers": [...], "upload_rates": {...}}
+    followed by one line per round
+      {"run": i, "round": r, "downloads": [[from, to, piece, blocks], ...],
+       "done": [peer ids that finished this round]}
+    """
+    def __init__(self, path, buffer_size=1 << 20):
+        self.f = open(path, "w", buffer_size)
+        self.run = -1
+
+    def start_run(self, peer_ids, upload_rates):
+        self.run += 1
+        self.peer_ids = peer_ids
+        self._write(dict(run=self.run, peers=peer_ids,
+                         upload_rates=upload_rates))
+
+    def record_round(self, rd, downloads, done):
+        """
+        downloads: dict : peer_id -> [downloads] for the round
+        done: list of peer ids that finished in the round
+        """
+        dls = [[d.from_id, d.to_id, d.piece, d.blocks]
+               for pid in self.peer_ids for d in downloads[pid]]
+        self._write(dict(run=self.run, round=rd, downloads=dls, done=done))
+
+    def _write(self, obj):
+        self.f.write(json.dumps(obj, separators=(",", ":")))
+        self.f.write("\n")
+
+    def close(self):
+        self.f.close()
@@ -10,10 +10,15 @@
 #  - clicks / slot is rounded to the nearest click
 
 from optparse import OptionParser
+import collections
 import copy
+import hashlib
+import inspect
 import itertools
 import logging
 import math
+import multiprocessing
+import os
 import pprint
 import random
 import sys
@@ -22,6 +27,10 @@ from gsp import GSP
 from vcg import VCG
 from history import History
 from stats import Stats
+# runcache is shared with the other psets
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "common"))
+from runcache import RunCache
 
 #from bbagent import BBAgent
 #from truthfulagent import TruthfulAgent
@@ -46,6 +55,13 @@ def agent_slot(occupants, a_id, t):
 
 
 def sim(config):
+    """
+    Run the auction once.  Returns (history, symmetric): symmetric is
+    True if nothing in the run was left to chance or ran out -- no tied
+    bids, no agent drawing from random, no agent out of budget -- so the
+    run would have come out the same, relabeled, with the values of agents
+    of the same class swapped.
+    """
     agents = init_agents(config)
     # Uncomment to print agents.
     #for a in agents:
@@ -65,6 +81,14 @@ def sim(config):
 
     reserve = config.reserve
 
+    # The mechanisms' own random numbers (for breaking ties), drawn apart
+    # from the agents'
+    auction_rng = random.Random(random.getrandbits(64))
+    # To tell whether the agents used random
+    rng_state = random.getstate()
+    # Why the run isn't symmetric, if it isn't
+    asymmetric = set()
+
     # Dictionaries : round # -> per_slot_list_of_whatever
     slot_occupants = {}
     slot_clicks = {}
@@ -73,20 +97,15 @@ def sim(config):
     values = {}
     bids = {}
 
-    history = History(bids, slot_occupants, slot_clicks,
-                      per_click_payments, slot_payments, n)
+    history = History(n_agents=n, capacity=config.num_rounds)
 
-    def total_spent(agent_id, end):
-        """
-        Compute total amount spent by agent_id through (not including)
-        round end.
-        """
-        s = 0
-        for t in range(end):
-            slot = agent_slot(slot_occupants, agent_id, t)
-            if slot != -1:
-                s += slot_payments[t][slot]
-        return s
+    # Ledger: agent id -> total spent in the rounds charged so far
+    spent = dict((a.id, 0) for a in agents)
+
+    def charge(t):
+        """Add round t's slot payments to the ledger"""
+        for (slot, agent_id) in enumerate(slot_occupants[t]):
+            spent[agent_id] += slot_payments[t][slot]
 
     def run_round(top_slot_clicks, t):
         """ top_slot_clicks is the expected number of clicks in the top slot
@@ -95,21 +114,24 @@ def sim(config):
         if t == 0:
             bids[t] = [(a.id, a.initial_bid(reserve)) for a in agents]
         else:
-            # Bids from agents with no money get reduced to zero
-            have_money = lambda a: total_spent(a.id, t) < config.budget
-            still_have_money = filter(have_money, agents)
+            # Rounds before t have been charged.  Agents with no money
+            # left bid zero, without being asked.
             current_bids = []
             for a in agents:
-                b = a.bid(t, history, reserve)
-                if total_spent(a.id, t) < config.budget:
-                    current_bids.append( (a.id, b))
+                if spent[a.id] < config.budget:
+                    current_bids.append( (a.id, a.bid(t, history, reserve)))
                 else:
                     # Out of money: make bid zero.
                     current_bids.append( (a.id, 0))
+                    asymmetric.add("budget")
             bids[t] = current_bids
 
         ##   Ignore those below reserve price
         active_bidders = len(filter(lambda (i,b): b >= reserve, bids[t]))
+        valid_amounts = [b for (i, b) in bids[t] if b >= reserve]
+        if len(set(valid_amounts)) < len(valid_amounts):
+            # Ranked at random
+            asymmetric.add("tie")
         #####################################
         ##   1a.   Define no. of slots 
         #num_slots = max(1, active_bidders-1) 
@@ -122,7 +144,7 @@ def sim(config):
         ##  2. Run mechanism and allocate slots
         (slot_occupants[t], per_click_payments[t]) = (
             mechanism.compute(slot_clicks[t],
-                              reserve, bids[t]))
+                              reserve, bids[t], auction_rng))
         
         ##  3. Define payments
         slot_payments[t] = map(lambda (x,y): x*y,
@@ -137,6 +159,8 @@ def sim(config):
             return None
         
         map(agent_value, slot_occupants[t], slot_clicks[t], slot_payments[t])
+        history.add_round(bids[t], slot_occupants[t], slot_clicks[t],
+                          per_click_payments[t], slot_payments[t])
         
         ## Debugging. Set to True to see what's happening.
         log_console = False
@@ -149,7 +173,8 @@ def sim(config):
             logging.info("\tper_click_payments: %s" % per_click_payments[t])
             logging.info("\tslot_payments: %s" % slot_payments[t])
             logging.info("\tUtility: %s" % values[t])
-            logging.info("\ttotals spent: %s" % [total_spent(a.id, t+1) for a in agents])
+            logging.info("\ttotals spent before this round: %s" %
+                         [spent[a.id] for a in agents])
             
     
     for t in range(0, config.num_rounds):
@@ -161,13 +186,17 @@ def sim(config):
             mechanism = VCG
         ##   0.  Runs one round
         run_round(top_slot_clicks, t)
+        # Agents see what was spent before this round
         for a in agents:
-            history.set_agent_spent(a.id, total_spent(a.id, t))
+            history.set_agent_spent(a.id, spent[a.id])
+        charge(t)
     
     for a in agents:
-        history.set_agent_spent(a.id, total_spent(a.id, config.num_rounds))
+        history.set_agent_spent(a.id, spent[a.id])
+    if random.getstate() != rng_state:
+        asymmetric.add("random")
     
-    return history
+    return (history, not asymmetric)
 
 class Params:
     def __init__(self):
@@ -206,10 +235,81 @@ def init_agents(conf):
 
     return map(load, conf.agent_class_names, params)
 
-def get_utils(n, options):
+def get_utils(n, options, rng=random):
     m = options.min_val
     M = options.max_val
-    return [random.randint(m, M) for i in range(n)]
+    return [rng.randint(m, M) for i in range(n)]
+
+# Options that affect the results of a run, for the run cache.
+RESULT_SETTINGS = ["mechanism", "num_rounds", "budget", "reserve", "dropoff",
+                   "agent_class_names", "agent_values"]
+
+# Everything sim() reads, for one run.  Immutable, so a run can't change
+# the settings of the runs after it, and cheap to send to a worker.
+RunConfig = collections.namedtuple("RunConfig",
+                                   RESULT_SETTINGS + ["agent_classes"])
+
+def run_config(options, values):
+    """The RunConfig for running options with agent values values"""
+    settings = dict((k, getattr(options, k)) for k in RESULT_SETTINGS
+                    if k != "agent_values")
+    settings.update(agent_class_names=tuple(options.agent_class_names),
+                    agent_values=tuple(values),
+                    agent_classes=options.agent_classes)
+    return RunConfig(**settings)
+
+# Where run results are cached unless --cache-dir says otherwise: next to
+# this file, not wherever the sim was started from.
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 ".runcache")
+
+# Simulator modules whose source goes into the run cache key, along with
+# the agents' modules.
+SIM_MODULES = [__name__, "gsp", "vcg", "history", "stats", "util"]
+
+def open_cache(options):
+    """
+    The RunCache to use, or None.  Runs are only cached when their seeds
+    are reproducible.
+    """
+    if options.no_cache or options.seed is None:
+        return None
+    modules = list(SIM_MODULES)
+    for agent_class in options.agent_classes.values():
+        modules.extend(c.__module__ for c in inspect.getmro(agent_class))
+    return RunCache(options.cache_dir, options.cache_size << 20, modules)
+
+def run_once(config, seed, cache=None):
+    """
+    Run the sim once with the RunConfig config, seeding random with seed.
+    Returns ([utility per agent], [spend per agent], revenue, symmetric),
+    symmetric as sim() says.
+    """
+    if cache:
+        settings = dict((k, getattr(config, k)) for k in RESULT_SETTINGS)
+        key = cache.key(settings, seed)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    n = len(config.agent_values)
+    random.seed(seed)
+    (history, symmetric) = sim(config)
+    stats = Stats(history, dict(zip(range(n), config.agent_values)))
+    result = ([stats.total_utility(id) for id in range(n)],
+              [history.agents_spent[id] for id in range(n)],
+              stats.total_revenue(), symmetric)
+    if cache:
+        cache.put(key, result)
+    return result
+
+def run_task(task):
+    """
+    Run one (config, seed, cache) task.  Lives at module level so worker
+    processes can run it.
+    """
+    (config, seed, cache) = task
+    return run_once(config, seed, cache)
 
 def configure_logging(loglevel):
     numeric_level = getattr(logging, loglevel.upper(), None)
@@ -241,6 +341,114 @@ def parse_agents(args):
             raise ValueError("Bad argument: %s\n" % c)
     return ans
 
+def class_groups(class_names):
+    """The agent ids of each class, in order of first appearance"""
+    groups = collections.OrderedDict()
+    for (id, name) in enumerate(class_names):
+        groups.setdefault(name, []).append(id)
+    return groups.values()
+
+def multiset_permutations(items):
+    """
+    Every distinct ordering of items, once each, in lexicographic order:
+    next-permutation steps from the sorted list.
+    """
+    a = sorted(items)
+    n = len(a)
+    while True:
+        yield tuple(a)
+        i = n - 2
+        while i >= 0 and a[i] >= a[i + 1]:
+            i -= 1
+        if i < 0:
+            return
+        j = n - 1
+        while a[j] <= a[i]:
+            j -= 1
+        (a[i], a[j]) = (a[j], a[i])
+        a[i + 1:] = reversed(a[i + 1:])
+
+def distinct_assignments(groups):
+    """
+    One value permutation (the index of the value each agent id gets) for
+    each distinct way of handing the values out to the classes in groups,
+    with how many permutations it stands for: [(perm, weight)].  Within a
+    group, the agents get their values in increasing order.
+    """
+    n = sum(len(g) for g in groups)
+    classes = [None] * n   # agent id -> index of its group
+    for (k, g) in enumerate(groups):
+        for id in g:
+            classes[id] = k
+    weight = 1
+    for g in groups:
+        weight *= math.factorial(len(g))
+    ans = []
+    for owners in multiset_permutations(classes):
+        # owners[v]: the group whose next agent gets value v
+        perm = [None] * n
+        agents = [iter(g) for g in groups]
+        for (v, k) in enumerate(owners):
+            perm[next(agents[k])] = v
+        ans.append((tuple(perm), weight))
+    return ans
+
+def relabelings(perm, groups):
+    """
+    Every permutation that only differs from perm by swapping values
+    between agents of a group, perm itself first if its groups' values
+    are in increasing order.
+    """
+    choices = [itertools.permutations([perm[id] for id in g])
+               for g in groups]
+    for values in itertools.product(*choices):
+        ans = list(perm)
+        for (g, vs) in zip(groups, values):
+            for (id, v) in zip(g, vs):
+                ans[id] = v
+        yield tuple(ans)
+
+def run_seed(base, perm):
+    """
+    The seed to run perm with: the same whichever permutations are run,
+    and however many workers run them.
+    """
+    return int(hashlib.sha1(repr((base, perm))).hexdigest()[:15], 16)
+
+def add_up(classes, results, groups):
+    """
+    ([total utility per agent], [total spend per agent], total revenue)
+    over all the permutations classes stand for (see distinct_assignments).
+    results: perm -> run_once result, for every perm of classes, and every
+    relabeling of the ones that weren't symmetric.
+
+    A symmetric run stands for all its relabelings, which between them
+    give each agent of a group each of the group's results weight /
+    len(group) times.  Otherwise the relabelings' own runs are added up.
+    """
+    n = sum(len(g) for g in groups)
+    utils = [0] * n
+    spent = [0] * n
+    revenue = 0
+    for (p, weight) in classes:
+        if results[p][3]:
+            (u, s, r, symmetric) = results[p]
+            for g in groups:
+                times = weight // len(g)
+                (u_g, s_g) = (sum(u[j] for j in g), sum(s[j] for j in g))
+                for id in g:
+                    utils[id] += times * u_g
+                    spent[id] += times * s_g
+            revenue += weight * r
+        else:
+            for q in relabelings(p, groups):
+                (u, s, r, symmetric) = results[q]
+                for id in range(n):
+                    utils[id] += u[id]
+                    spent[id] += s[id]
+                revenue += r
+    return (utils, spent, revenue)
+
 def main(args):
 
     usage_msg = "Usage:  %prog [options] PeerClass1[,cnt] PeerClass2[,cnt2] ..."
@@ -291,6 +499,30 @@ def main(args):
                       dest="seed", default=None, type="int",
                       help="seed for random numbers")
 
+    parser.add_option("--no-cache",
+                      dest="no_cache", default=False, action="store_true",
+                      help="Don't read or write cached run results")
+
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=DEFAULT_CACHE_DIR,
+                      help="Where to cache run results (only used with --seed)")
+
+    parser.add_option("--cache-size",
+                      dest="cache_size", default=64, type="int",
+                      help="Max size of the run cache, in MB")
+
+    parser.add_option("--no-symmetry",
+                      dest="no_symmetry", default=False, action="store_true",
+                      help="Run every value permutation.  By default, of "
+                      "the permutations that only swap values between "
+                      "agents of the same class, one is run and counted "
+                      "for all of them -- unless its run had tied bids, "
+                      "an agent out of budget or an agent drawing random "
+                      "numbers, in which case they are all run")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to spread runs across")
 
     (options, args) = parser.parse_args()
 
@@ -305,13 +537,16 @@ def main(args):
 
     configure_logging(options.loglevel)
 
-    if options.seed != None:
-        random.seed(options.seed)
+    # Values, permutations and the seed for each run all come from here;
+    # each run then gets random seeded with its own seed, so it can be
+    # cached.
+    rng = random.Random(options.seed)
 
     # Add some more config options
     options.agent_class_names = agents_to_run
     options.agent_classes = load_modules(options.agent_class_names)
     options.dropoff = 0.75
+    cache = open_cache(options)
 
     logging.info("Starting simulation...")
     n = len(agents_to_run)
@@ -328,36 +563,68 @@ def main(args):
     else:
         num_perms = math.factorial(n)
 
+    # Agents of the same class are interchangeable, so of the permutations
+    # that only swap values between agents of a class, only one is run,
+    # and counted once for each of them.  Only when that's exact, though:
+    # if its run wasn't symmetric (see sim) the others are run too.
+    if approx or options.no_symmetry:
+        # Samples are run as drawn
+        groups = [[id] for id in range(n)]
+    else:
+        groups = class_groups(agents_to_run)
+
     av_value=range(0,n)
     total_spent = [0 for i in range(n)]
 
-    ##  iters = no. of samples to take
-    for i in range(options.iters):
-        values = get_utils(n, options)
-        logging.info("==== Iteration %d / %d.  Values %s ====" % (i, options.iters, values))
-        ## Create permutations (permutes the random values, and assigns them to agents)
-        if approx:
-            perms = [shuffled(values) for i in range(options.max_perms)]
-        else:
-            perms = itertools.permutations(values)
-
-        total_rev = 0
-        ## Iterate over permutations
-        for vals in perms:
-            options.agent_values = list(vals)
-            values = dict(zip(range(n), list(vals)))
-            ##   Runs simulation  ###
-            history = sim(options)
-            ###  simulation ends.
-            stats = Stats(history, values)
-            # Print stats in console?
-            # logging.info(stats)
-            
+    # Workers are forked after the agent classes are loaded
+    pool = None
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers)
+
+    try:
+        ##  iters = no. of samples to take
+        for i in range(options.iters):
+            values = get_utils(n, options, rng)
+            logging.info("==== Iteration %d / %d.  Values %s ====" % (i, options.iters, values))
+            # Each run's seed comes from this and its permutation
+            base = rng.randint(0, sys.maxint)
+            ## Create permutations (permutes the random values, and assigns them to agents)
+            ## (as the index of the value each agent gets), with how many
+            ## permutations each stands for
+            if approx:
+                classes = [(tuple(shuffled(range(n), rng)), 1)
+                           for i in range(options.max_perms)]
+            else:
+                classes = distinct_assignments(groups)
+
+            results = dict()   # perm -> run_once result
+            def run_all(perms):
+                perms = sorted(set(perms) - set(results))
+                tasks = [(run_config(options, [values[j] for j in p]),
+                          run_seed(base, p), cache) for p in perms]
+                if pool:
+                    chunk = max(1, len(tasks) // (4 * options.workers))
+                    ans = pool.imap(run_task, tasks, chunk)
+                else:
+                    ans = itertools.imap(run_task, tasks)
+                results.update(zip(perms, ans))
+
+            run_all([p for (p, weight) in classes])
+            run_all([q for (p, weight) in classes if not results[p][3]
+                     for q in relabelings(p, groups)])
+            if not approx and len(results) < num_perms:
+                logging.info("Ran %d of %d permutations; the rest are "
+                             "relabelings" % (len(results), num_perms))
+
+            (utils, spent, total_rev) = add_up(classes, results, groups)
             for id in range(n):
-                totals[id] += stats.total_utility(id)
-                total_spent[id] += history.agents_spent[id]
-            total_rev += stats.total_revenue()
-        total_revenues.append(total_rev / float(num_perms))
+                totals[id] += utils[id]
+                total_spent[id] += spent[id]
+            total_revenues.append(total_rev / float(num_perms))
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
 
     ## total_spent = total amount of money spent by agents, for all iterations, all permutations, all rounds
     
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import heapq
 import random
 
 class GSP:
@@ -7,7 +8,7 @@ class GSP:
     Implements the generalized second price auction mechanism.
     """
     @staticmethod
-    def compute(slot_clicks, reserve, bids):
+    def compute(slot_clicks, reserve, bids, rng=random):
         """
         Given info about the setting (clicks for each slot, and reserve price),
         and bids (list of (id, bid) tuples), compute the following:
@@ -16,23 +17,16 @@ class GSP:
           per_click_payments: list of payments for each slot
               len(per_click_payments) = len(allocation)
 
-        If any bids are below the reserve price, they are ignored.
+        If any bids are below the reserve price, they are ignored.  Ties are
+        broken at random, using rng.
 
         Returns a pair of lists (allocation, per_click_payments):
          - allocation is a list of the ids of the bidders in each slot
             (in order)
          - per_click_payments is the corresponding payments.
         """
-        valid = lambda (a, bid): bid >= reserve
-        valid_bids = filter(valid, bids)
-
-        rev_cmp_bids = lambda (a1, b1), (a2, b2): cmp(b2, b1)
-        # shuffle first to make sure we don't have any bias for lower or
-        # higher ids
-        random.shuffle(valid_bids)
-        valid_bids.sort(rev_cmp_bids)
-
         num_slots = len(slot_clicks)
+        valid_bids = GSP.top_bids(num_slots + 1, reserve, bids, rng)
         allocated_bids = valid_bids[:num_slots]
         if len(allocated_bids) == 0:
             return ([], [])
@@ -50,6 +44,18 @@ class GSP:
         per_click_payments.append(last_payment)
         return (list(allocation), per_click_payments)
 
+    @staticmethod
+    def top_bids(k, reserve, bids, rng=random):
+        """
+        The k highest (id, bid) pairs with bid >= reserve, highest first.
+        Equal bids are ordered at random: each gets a random tie-break key
+        from rng, so no bias for lower or higher ids.  Only keeps k bids
+        around, so O(n log k) for n bids.
+        """
+        valid_bids = [(a, bid) for (a, bid) in bids if bid >= reserve]
+        return heapq.nlargest(k, valid_bids,
+                              key=lambda (a, bid): (bid, rng.random()))
+
     @staticmethod
     def bid_range_for_slot(slot, slot_clicks, reserve, bids):
         """
@@ -1,38 +1,102 @@
 #!/usr/bin/env python
 
-import copy
+
+class ReadOnlyList(list):
+    """
+    A list that can't be changed, so one copy can be handed to every agent.
+    Slicing, filter() and so on still give ordinary lists.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("history can't be changed")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = sort = reverse = _read_only
+
 
 class History:
-    class RoundHistory:
+    class RoundHistory(object):
         """
         Allows agents to access the history of a previous round.
-        Makes copies so clients can't change history.
+        Read-only, so the same view is shared by everyone who asks.
         """
+        __slots__ = ("bids", "occupants", "clicks", "per_click_payments",
+                     "slot_payments")
+
         def __init__(self, bids, occupants, clicks,
                      per_click_payments, slot_payments):
             """Takes the info for a _single_ round."""
-            self.bids = copy.deepcopy(bids)
-            self.occupants = copy.deepcopy(occupants)
-            self.clicks = copy.deepcopy(clicks)
-            self.per_click_payments = copy.deepcopy(per_click_payments)
-            self.slot_payments = copy.deepcopy(slot_payments)
-
-    def __init__(self, bids, occupants, clicks,
-                 per_click_payments, slot_payments, n_agents=3):
-        self.round = lambda t: History.RoundHistory(
-            bids[t], occupants[t],
-            clicks[t], per_click_payments[t],
-            slot_payments[t])
-
-        self.last_round = lambda : max(bids.keys())
+            put = object.__setattr__
+            put(self, "bids", bids)
+            put(self, "occupants", occupants)
+            put(self, "clicks", clicks)
+            put(self, "per_click_payments", per_click_payments)
+            put(self, "slot_payments", slot_payments)
+
+        def __setattr__(self, name, value):
+            raise AttributeError("history can't be changed")
+
+        def __delattr__(self, name):
+            raise AttributeError("history can't be changed")
+
+    def __init__(self, bids=(), occupants=(), clicks=(),
+                 per_click_payments=(), slot_payments=(), n_agents=3,
+                 capacity=0):
+        """
+        The first five arguments give each round's info, indexed by round
+        (lists, or dicts with keys 0..k-1).  Later rounds are added with
+        add_round().  capacity: number of rounds to make room for up front.
+        """
+        size = max(capacity, len(bids))
+        self._bids = [None] * size
+        self._occupants = [None] * size
+        self._clicks = [None] * size
+        self._per_click_payments = [None] * size
+        self._slot_payments = [None] * size
+        self._views = [None] * size
+        self._num_rounds = 0
+
         self.n_agents = n_agents
-        self.num_rounds = lambda : max(bids.keys()) + 1
         ## How much the agents spend.
         self.agents_spent = [0 for i in range(n_agents)]
 
-    def set_agent_spent(self, aid, spent):
-        self.agents_spent[aid] = spent
+        for t in range(len(bids)):
+            self.add_round(bids[t], occupants[t], clicks[t],
+                           per_click_payments[t], slot_payments[t])
 
+    def add_round(self, bids, occupants, clicks, per_click_payments,
+                  slot_payments):
+        """Record the next round's info"""
+        t = self._num_rounds
+        if t == len(self._bids):
+            for column in (self._bids, self._occupants, self._clicks,
+                           self._per_click_payments, self._slot_payments,
+                           self._views):
+                column.append(None)
+        self._bids[t] = ReadOnlyList(bids)
+        self._occupants[t] = ReadOnlyList(occupants)
+        self._clicks[t] = ReadOnlyList(clicks)
+        self._per_click_payments[t] = ReadOnlyList(per_click_payments)
+        self._slot_payments[t] = ReadOnlyList(slot_payments)
+        self._num_rounds = t + 1
 
+    def round(self, t):
+        """The RoundHistory for round t"""
+        if t < 0 or t >= self._num_rounds:
+            raise IndexError("no round %d in history" % t)
+        view = self._views[t]
+        if view is None:
+            view = History.RoundHistory(
+                self._bids[t], self._occupants[t], self._clicks[t],
+                self._per_click_payments[t], self._slot_payments[t])
+            self._views[t] = view
+        return view
 
+    def last_round(self):
+        return self._num_rounds - 1
 
+    def num_rounds(self):
+        return self._num_rounds
+
+    def set_agent_spent(self, aid, spent):
+        self.agents_spent[aid] = spent
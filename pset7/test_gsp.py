@@ -4,7 +4,10 @@
 # run py.test to run the tests (it magically finds things
 # called test_blah and runs them)
 
+import random
+
 from gsp import GSP
+from vcg import VCG
 
 def test_mechanism():
     num_slots = 4
@@ -72,6 +75,57 @@ def test_bid_ranges():
     assert bid_range(1, reserve) == (22, 22)
     assert bid_range(2, reserve) == (22, 22)
 
+def old_ranking(reserve, bids):
+    """How GSP.compute ranked bids before top_bids: shuffle, then cmp sort"""
+    valid_bids = filter(lambda (a, bid): bid >= reserve, bids)
+    random.shuffle(valid_bids)
+    valid_bids.sort(lambda (a1, b1), (a2, b2): cmp(b2, b1))
+    return valid_bids
+
+def test_top_bids_matches_sort():
+    rng = random.Random(1)
+    for trial in range(500):
+        n = rng.randint(0, 30)
+        # Distinct bids, so there are no ties to break
+        bids = zip(range(n), rng.sample(range(1000), n))
+        reserve = rng.choice([0, 100, 500])
+        k = rng.randint(1, 10)
+        assert GSP.top_bids(k, reserve, bids, rng) == \
+            old_ranking(reserve, bids)[:k]
+        slot_clicks = range(k, 0, -1)
+        for mech in [GSP, VCG]:
+            # Both mechanisms allocate the same way
+            assert (mech.compute(slot_clicks, reserve, bids, rng)[0] ==
+                    [a for (a, b) in old_ranking(reserve, bids)[:k]])
+
+def test_ties_broken_evenly():
+    bids = [(0, 5), (1, 7), (2, 5), (3, 5), (4, 1)]
+    counts = dict()
+    trials = 6000
+    for seed in range(trials):
+        (alloc, payments) = GSP.compute([3, 2], 0, bids,
+                                        random.Random(seed))
+        assert alloc[0] == 1
+        assert payments == [5, 5]
+        counts[alloc[1]] = counts.get(alloc[1], 0) + 1
+    assert sorted(counts) == [0, 2, 3]
+    for c in counts.values():
+        # Each of the three tied bidders gets second about a third of the
+        # time (expected 2000, stddev about 37)
+        assert abs(c - trials / 3) < 200
+
+def test_rng_reproducible():
+    bids = zip(range(20), [10] * 10 + [20] * 10)
+    for mech in [GSP, VCG]:
+        runs = [mech.compute([8, 4, 2, 1], 0, bids, random.Random(42))
+                for i in range(3)]
+        assert runs[0] == runs[1] == runs[2]
+        # Other seeds break the ties between the 20s differently
+        others = set(tuple(mech.compute([8, 4, 2, 1], 0, bids,
+                                        random.Random(seed))[0])
+                     for seed in range(20))
+        assert len(others) > 1
+
 test_bid_ranges()
 print("testing")
 test_mechanism()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import pytest
+
+from history import History
+
+# Two rounds of info, as sim() has always kept it: dicts round -> list
+bids = {0: [(0, 10), (1, 12), (2, 5)], 1: [(0, 11), (1, 9), (2, 7)]}
+occupants = {0: [1, 0], 1: [0, 1]}
+clicks = {0: [4, 2], 1: [5, 3]}
+per_click_payments = {0: [10, 5], 1: [9, 7]}
+slot_payments = {0: [40, 10], 1: [45, 21]}
+
+def make_history():
+    return History(bids, occupants, clicks, per_click_payments,
+                   slot_payments)
+
+def test_rounds_match_lists():
+    history = make_history()
+    assert history.num_rounds() == 2
+    assert history.last_round() == 1
+    for t in range(2):
+        r = history.round(t)
+        assert r.bids == bids[t]
+        assert r.occupants == occupants[t]
+        assert r.clicks == clicks[t]
+        assert r.per_click_payments == per_click_payments[t]
+        assert r.slot_payments == slot_payments[t]
+    # Agents filter and slice these; they get ordinary lists back
+    others = filter(lambda (a, b): a != 0, history.round(0).bids)
+    assert others == [(1, 12), (2, 5)]
+    others.sort()
+    assert history.round(0).clicks[:1] == [4]
+
+def test_views_are_read_only():
+    history = make_history()
+    r = history.round(0)
+    with pytest.raises(TypeError):
+        r.bids.append((3, 1))
+    with pytest.raises(TypeError):
+        r.bids.sort()
+    with pytest.raises(TypeError):
+        r.clicks[0] = 100
+    with pytest.raises(TypeError):
+        del r.occupants[0]
+    with pytest.raises(TypeError):
+        r.slot_payments += [1]
+    with pytest.raises(AttributeError):
+        r.bids = []
+    # The same view every time, unchanged
+    assert history.round(0) is r
+    assert r.bids == bids[0]
+    assert r.clicks == clicks[0]
+
+def test_add_round():
+    history = History(n_agents=3, capacity=1)
+    assert history.num_rounds() == 0
+    assert history.last_round() == -1
+    with pytest.raises(IndexError):
+        history.round(0)
+    # Past the capacity, so the columns grow
+    for t in range(2):
+        history.add_round(bids[t], occupants[t], clicks[t],
+                          per_click_payments[t], slot_payments[t])
+        assert history.num_rounds() == t + 1
+        assert history.last_round() == t
+        assert history.round(t).bids == bids[t]
+    first = history.round(0)
+    history.add_round([(0, 1)], [0], [1], [1], [1])
+    assert history.num_rounds() == 3
+    assert history.round(2).bids == [(0, 1)]
+    assert history.round(0) is first
+    assert first.slot_payments == slot_payments[0]
+    with pytest.raises(IndexError):
+        history.round(3)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import itertools
+
+from auction import (load_modules, run_config, run_once, class_groups,
+                     multiset_permutations, distinct_assignments,
+                     relabelings, run_seed, add_up)
+
+class Options:
+    """The options run_config reads"""
+    def __init__(self, class_names, budget, mechanism="gsp"):
+        self.mechanism = mechanism
+        self.num_rounds = 48
+        self.budget = budget
+        self.reserve = 0
+        self.dropoff = 0.75
+        self.agent_class_names = class_names
+        self.agent_classes = load_modules(class_names)
+
+def check_totals(class_names, values, budget, mechanism="gsp"):
+    """
+    Run every permutation of values, and check that adding up the
+    distinct assignments gives the same totals.  Returns how many of
+    those runs were and weren't symmetric.
+    """
+    options = Options(class_names, budget, mechanism)
+    n = len(values)
+    full = dict()
+    for p in itertools.permutations(range(n)):
+        config = run_config(options, [values[j] for j in p])
+        full[p] = run_once(config, run_seed(1, p))
+    singletons = [[id] for id in range(n)]
+    groups = class_groups(class_names)
+    classes = distinct_assignments(groups)
+    (utils, spent, revenue) = add_up(classes, full, groups)
+    expected = add_up([(p, 1) for p in sorted(full)], full, singletons)
+    # Utilities are floats, added up in a different order
+    for (x, y) in zip(utils + spent + [revenue],
+                      expected[0] + expected[1] + [expected[2]]):
+        assert abs(x - y) <= 1e-9 * max(1, abs(y))
+    counts = {True: 0, False: 0}
+    for (p, weight) in classes:
+        counts[full[p][3]] += 1
+    return counts
+
+def test_multiset_permutations():
+    assert list(multiset_permutations([1, 0, 1, 0])) == [
+        (0, 0, 1, 1), (0, 1, 0, 1), (0, 1, 1, 0),
+        (1, 0, 0, 1), (1, 0, 1, 0), (1, 1, 0, 0)]
+    assert list(multiset_permutations([2, 1, 0])) == list(
+        itertools.permutations([0, 1, 2]))
+    assert list(multiset_permutations([0])) == [(0,)]
+
+def test_distinct_assignments_cover_permutations():
+    groups = class_groups(["Truthful", "MewtBB", "Truthful", "MewtBB",
+                           "Truthful"])
+    assert groups == [[0, 2, 4], [1, 3]]
+    classes = distinct_assignments(groups)
+    assert len(classes) == 10
+    seen = set()
+    for (p, weight) in classes:
+        assert weight == 12
+        members = list(relabelings(p, groups))
+        assert members[0] == p
+        assert len(members) == weight
+        seen.update(members)
+    assert seen == set(itertools.permutations(range(5)))
+
+def test_weighted_same_as_full_run():
+    counts = check_totals(["Truthful"] * 3 + ["MewtBB"] * 2,
+                          [40, 75, 110, 150, 90], 500000)
+    assert counts[True] > 0
+
+def test_binding_budget_not_symmetric():
+    # Budgets run out, so some runs can't stand for their relabelings
+    counts = check_totals(["Truthful"] * 3 + ["MewtBB"],
+                          [60, 100, 140, 170], 40000, "vcg")
+    assert counts[False] > 0
@@ -20,9 +20,9 @@ def argmax_f(keys, func):
     return max(imap(lambda key: (func(*key), key), keys))[1]
 
 
-def shuffled(l):
+def shuffled(l, rng=random):
     x = l[:]
-    random.shuffle(x)
+    rng.shuffle(x)
     return x
 
 
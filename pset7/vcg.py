@@ -10,7 +10,7 @@ class VCG:
     Implements the Vickrey-Clarke-Groves mechanism for ad auctions.
     """
     @staticmethod
-    def compute(slot_clicks, reserve, bids):
+    def compute(slot_clicks, reserve, bids, rng=random):
         """
         Given info about the setting (clicks for each slot, and reserve price),
         and bids (list of (id, bid) tuples), compute the following:
@@ -19,7 +19,8 @@ class VCG:
           per_click_payments: list of payments for each slot
               len(per_click_payments) = len(allocation)
 
-        If any bids are below the reserve price, they are ignored.
+        If any bids are below the reserve price, they are ignored.  Ties are
+        broken at random, using rng.
 
         Returns a pair of lists (allocation, per_click_payments):
          - allocation is a list of the ids of the bidders in each slot
@@ -28,49 +29,34 @@ class VCG:
         """
 
         # The allocation is the same as GSP, so we filled that in for you...
-        valid = lambda (a, bid): bid >= reserve
-        valid_bids = filter(valid, bids)
-
-        rev_cmp_bids = lambda (a1, b1), (a2, b2): cmp(b2, b1)
-        # shuffle first to make sure we don't have any bias for lower or
-        # higher ids
-        random.shuffle(valid_bids)
-        valid_bids.sort(rev_cmp_bids)
-
         num_slots = len(slot_clicks)
+        valid_bids = GSP.top_bids(num_slots + 1, reserve, bids, rng)
         allocated_bids = valid_bids[:num_slots]
         if len(allocated_bids) == 0:
             return ([], [])
         
         (allocation, just_bids) = zip(*allocated_bids)
 
-
-        # TODO: You just have to implement this function
-        def total_payment(k):
-            """
-            Total payment for a bidder in slot k.
-            """
-            c = slot_clicks
-            n = len(allocation)
-            if k >= n:
-                return 0
-            elif k == (n-1):
-                if len(valid_bids) > n: # if next bid is greater than reserve
-                    return c[k] * valid_bids[n][1]
-                else:
-                    return c[k] * reserve
-            else:
-                return (c[k] - c[k+1]) * just_bids[k+1] + total_payment(k+1)
-
-
-            # TODO: Compute the payment and return it.
+        # Total payment for the bidder in slot k: the externality it imposes
+        # on the bidders below, each pushed down one slot, and on the first
+        # bidder left out (or the reserve).  That's the payment for slot
+        # k+1 plus one more term, so one backward pass gets them all.
+        c = slot_clicks
+        n = len(allocation)
+        if len(valid_bids) > n: # if next bid is greater than reserve
+            total = c[n-1] * valid_bids[n][1]
+        else:
+            total = c[n-1] * reserve
+        totals = [total] * n
+        for k in range(n-2, -1, -1):
+            total = (c[k] - c[k+1]) * just_bids[k+1] + total
+            totals[k] = total
 
         def norm(totals):
             """Normalize total payments by the clicks in each slot"""
             return map(lambda (x,y): x/y, zip(totals, slot_clicks))
 
-        per_click_payments = norm(
-            [total_payment(k) for k in range(len(allocation))])
+        per_click_payments = norm(totals)
         
         return (list(allocation), per_click_payments)
 